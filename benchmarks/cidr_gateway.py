@@ -0,0 +1,72 @@
+"""
+Benchmarks the subnet gateway computation of InitialiseFwLambda.
+
+Compares cidrutil.gateway_ip() with the previous get_gw_ip(), which took element [1] of list(netaddr.IPNetwork(cidr)),
+for subnets from /28 to /8.  Time and peak memory (tracemalloc) are reported for each prefix length.  The previous
+function is only run when netaddr is installed, and only down to --legacy-limit as a /8 builds 16 million objects.
+
+Usage: python benchmarks/cidr_gateway.py [--repeat 1000] [--legacy-limit 16]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bootstrap', 'lambda',
+                                'lambda-combined'))
+
+import cidrutil  # noqa: E402
+
+PREFIXES = (28, 24, 20, 16, 12, 8)
+
+
+def legacy_gw_ip(cidr):
+    import netaddr
+    ip = netaddr.IPNetwork(cidr)
+    iplist = list(ip)
+    return iplist[1]
+
+
+def measure(function, cidr, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function(cidr)
+    elapsed = (time.perf_counter() - start) / repeat
+    # Memory is measured in a separate call as tracing slows the calls down
+    tracemalloc.start()
+    function(cidr)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return str(result), elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the subnet gateway computation')
+    parser.add_argument('--repeat', type=int, default=1000, help='Calls per prefix for cidrutil')
+    parser.add_argument('--legacy-limit', type=int, default=16, help='Shortest prefix run with netaddr')
+    args = parser.parse_args()
+
+    try:
+        import netaddr  # noqa: F401
+        have_netaddr = True
+    except ImportError:
+        have_netaddr = False
+        print('netaddr is not installed, only cidrutil is measured')
+
+    print('{:<16} {:>16} {:>12} {:>16} {:>14}'.format('Subnet', 'cidrutil usec', 'peak KiB', 'netaddr list ms',
+                                                        'peak MiB'))
+    for prefix in PREFIXES:
+        cidr = '10.0.0.0/{}'.format(prefix)
+        gateway, elapsed, peak = measure(cidrutil.gateway_ip, cidr, args.repeat)
+        legacy = ''
+        if have_netaddr and prefix >= args.legacy_limit:
+            legacy_gateway, legacy_elapsed, legacy_peak = measure(legacy_gw_ip, cidr, 1)
+            assert legacy_gateway == gateway, 'Gateways differ for {}'.format(cidr)
+            legacy = '{:>16.2f} {:>14.1f}'.format(legacy_elapsed * 1000, legacy_peak / 1048576.0)
+        print('{:<16} {:>16.2f} {:>12.1f} {}'.format(cidr, elapsed * 1e6, peak / 1024.0, legacy))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmarks the cold start of each Lambda function in bootstrap/lambda/lambda-combined.
+
+Every run starts a new python process, as Lambda does for a cold start, and measures the time taken to import the
+handler module and the time taken by the first call of the handler.  The first call uses an event that takes the
+cheapest path through the handler so that it measures the start up work (settings, lazily built clients) rather
+than the AWS and firewall calls:
+
+    TransitGatewayRouteMonitorLambda  EC2 state-change event for an instance that is not a firewall
+    TransitGatewayInitialiseLambda    CloudFormation Update request
+    DeleteLambdaEni                   CloudFormation Create request, the response is sent to a closed local port
+    InitialiseFwLambda                Step function event, stops at describe_subnets as no AWS credentials are set
+
+The processes run without AWS credentials so no AWS API is ever called.  The median of the runs is reported.
+
+Usage: python benchmarks/cold_start.py [--runs 5] [--json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bootstrap', 'lambda', 'lambda-combined')
+
+HANDLERS = [
+    {
+        'module': 'TransitGatewayRouteMonitorLambda',
+        'handler': 'lambda_handler',
+        'event': {'source': 'aws.ec2', 'detail-type': 'EC2 Instance State-change Notification',
+                  'time': '2019-01-01T00:00:00Z', 'detail': {'instance-id': 'i-00000000', 'state': 'running'}},
+        'environ': {'preempt': 'no', 'VpcSummaryRoute': '10.0.0.0/8', 'fw1Trusteni': 'eni-1', 'fw2Trusteni': 'eni-2',
+                    'fromTGWRouteTableId': 'rtb-1', 'fw1Trustip': '127.0.0.1', 'fw2Trustip': '127.0.0.1',
+                    'apikey': 'key', 'splitroutes': 'no', 'Fw1InstanceId': 'i-1', 'Fw2InstanceId': 'i-2'},
+    },
+    {
+        'module': 'TransitGatewayInitialiseLambda',
+        'handler': 'lambda_handler',
+        'event': {'RequestType': 'Update'},
+        'environ': {'region': 'us-east-1', 'toTGWRouteTableId': 'rtb-1', 'vpc0HostRouteTableid': 'rtb-2',
+                    'vpc1HostRouteTableid': 'rtb-3', 'transitGatewayid': 'tgw-1', 'InitFWStateMachine': 'arn',
+                    'VpcSummaryRoute': '10.0.0.0/8'},
+    },
+    {
+        'module': 'DeleteLambdaEni',
+        'handler': 'handler',
+        'event': {'RequestType': 'Create', 'ResponseURL': 'http://127.0.0.1:9/', 'StackId': 'stack',
+                  'RequestId': 'request', 'LogicalResourceId': 'resource',
+                  'ResourceProperties': {'VPCID': 'vpc-1', 'region': 'us-east-1'}},
+        'environ': {},
+    },
+    {
+        'module': 'InitialiseFwLambda',
+        'handler': 'lambda_handler',
+        'event': {},
+        'environ': {'VpcSummaryRoute': '10.0.0.0/8', 'fw1TrustIp': '127.0.0.1', 'fw2TrustIp': '127.0.0.1',
+                    'fw1UntrustIp': '127.0.0.1', 'fw2UntrustIp': '127.0.0.1', 'trustAZ1Subnet': 'subnet-1',
+                    'trustAZ2Subnet': 'subnet-2', 'apikey': 'key'},
+    },
+]
+
+# Run in the child process.  Prints the import and first call times in seconds as json.
+CHILD = """
+import io, json, sys, time, contextlib
+start = time.perf_counter()
+import {module} as module
+imported = time.perf_counter()
+
+class Context(object):
+    log_stream_name = 'cold-start'
+    function_name = '{module}'
+    def get_remaining_time_in_millis(self):
+        return 60000
+
+error = None
+with contextlib.redirect_stdout(io.StringIO()):
+    try:
+        module.{handler}(json.loads(sys.argv[1]), Context())
+    except Exception as e:
+        error = type(e).__name__
+called = time.perf_counter()
+print(json.dumps({{'import': imported - start, 'first_call': called - imported, 'error': error}}))
+"""
+
+
+def child_environ(environ):
+    env = {key: value for key, value in os.environ.items() if not key.startswith('AWS_')}
+    env.update({
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'AWS_EC2_METADATA_DISABLED': 'true',
+        'AWS_SHARED_CREDENTIALS_FILE': os.devnull,
+        'AWS_CONFIG_FILE': os.devnull,
+        'PYTHONDONTWRITEBYTECODE': '1',
+    })
+    env.update(environ)
+    return env
+
+
+def measure(handler):
+    code = CHILD.format(module=handler['module'], handler=handler['handler'])
+    output = subprocess.check_output([sys.executable, '-c', code, json.dumps(handler['event'])], cwd=LAMBDA_DIR,
+                                     env=child_environ(handler['environ']), stderr=subprocess.DEVNULL)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the cold start of the Lambda functions')
+    parser.add_argument('--runs', type=int, default=5, help='Cold starts per function')
+    parser.add_argument('--json', action='store_true', help='Print the results as json')
+    args = parser.parse_args()
+
+    results = []
+    for handler in HANDLERS:
+        runs = [measure(handler) for _ in range(args.runs)]
+        results.append({
+            'module': handler['module'],
+            'import_ms': statistics.median(run['import'] for run in runs) * 1000,
+            'first_call_ms': statistics.median(run['first_call'] for run in runs) * 1000,
+            'error': runs[-1]['error'],
+        })
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+    print('{:<34} {:>10} {:>14}  {}'.format('Function', 'Import ms', 'First call ms', 'First call ended with'))
+    for result in results:
+        print('{:<34} {:>10.1f} {:>14.1f}  {}'.format(result['module'], result['import_ms'], result['first_call_ms'],
+                                                     result['error'] or 'return'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,462 @@
+"""
+Local HTTPS stand-in for the PAN-OS XML API of a VM-Series firewall.
+
+Answers the /api calls made by deploy.py and the Lambda functions:
+
+    type=op      show chassis-ready, show system info, show jobs id
+    type=keygen  returns the API key for the configured username and password
+    type=config  set, edit, delete and multi-config change the candidate configuration, keyed by xpath.  get reads
+                 the candidate and show the running configuration.  Like PAN-OS, a show of a missing node is an
+                 error with code 7, and multi-config is rejected when the emulated version is older than 9.0.  The
+                 default version is the 8.1.0 of bootstrap.xml.
+    type=commit  starts a commit job that copies the candidate to the running configuration after commit_time
+                 seconds, or answers that there are no changes
+
+The firewall goes through boot phases, each lasting a number of seconds, and the last phase lasts for ever:
+
+    no-answer  connections are accepted but never answered, as while the firewall boots
+    error      every call gets an HTTP 503, as while the management server restarts
+    almost     the management plane answers but chassis-ready is 'no' while the dataplane starts
+    ready      chassis-ready is 'yes'
+
+Latency, jitter and a rate of dropped connections can be added to every call.  A self signed certificate is
+created with the openssl command line tool.
+
+As a server:  python benchmarks/fake_panos.py --port 8443 --no-answer 30 --error 10 --almost 20 --latency 50
+From python:  with FakePanos(phases=[('almost', 5)]) as fw: panosapi.chassis_ready(fw.address, fw.api_key)
+"""
+
+import argparse
+import copy
+import http.server
+import os
+import random
+import re
+import shutil
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as et
+from xml.sax.saxutils import escape
+
+NO_ANSWER = 'no-answer'
+ERROR = 'error'
+ALMOST = 'almost'
+READY = 'ready'
+PHASES = (NO_ANSWER, ERROR, ALMOST, READY)
+
+DEFAULT_API_KEY = 'LUFRPT1fakeapikey'
+# The version of the configuration in bootstrap/config/bootstrap.xml
+DEFAULT_SW_VERSION = '8.1.0'
+# Longest time a connection is held without an answer during the no-answer phase
+MAX_HANG = 30
+
+
+def make_certificate(directory):
+    """
+    Creates a self signed certificate and key for the server
+
+    :param directory: Directory for the cert.pem and key.pem files
+    :return: Tuple of certificate file and key file
+    """
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-keyout', keyfile,
+                           '-out', certfile, '-days', '1', '-subj', '/CN=fake-panos'],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+
+def response(result='', status='success', code=None):
+    """
+    :param result: Inner xml of the result element
+    :param status: 'success' or 'error'
+    :param code: Optional PAN-OS response code
+    :return: Response body
+    """
+    code = ' code="{}"'.format(code) if code else ''
+    return '<response status="{}"{}><result>{}</result></response>'.format(status, code, result).encode('utf-8')
+
+
+def message(text, code=20):
+    """
+    :return: Body of a successful config change, which has a msg rather than a result
+    """
+    return '<response status="success" code="{}"><msg>{}</msg></response>'.format(code, escape(text)).encode('utf-8')
+
+
+def error(text, code=None):
+    return response('<msg><line>{}</line></msg>'.format(escape(text)), status='error', code=code)
+
+
+def xpath_node(xpath):
+    """
+    :return: An empty element for the node an xpath points to, for example <entry name="vnets"> for
+             entry[@name='vnets']
+    """
+    match = re.match(r"([\w-]+)(?:\[@name='([^']*)'\])?$", xpath.rstrip('/').split('/')[-1])
+    if match is None:
+        return et.Element('entry')
+    tag, name = match.groups()
+    return et.Element(tag, {'name': name} if name else {})
+
+
+def same_node(a, b):
+    return a.tag == b.tag and a.get('name') == b.get('name')
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        query = urllib.parse.urlsplit(self.path).query
+        self._handle(urllib.parse.parse_qs(query))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8')
+        params = urllib.parse.parse_qs(body)
+        params.update(urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query))
+        self._handle(params)
+
+    def _handle(self, params):
+        firewall = self.server.firewall
+        params = {key: values[0] for key, values in params.items()}
+        phase = firewall.phase()
+        firewall.count('requests')
+
+        firewall.delay()
+        if phase == NO_ANSWER:
+            firewall.count('unanswered')
+            time.sleep(min(firewall.phase_remaining(), MAX_HANG))
+            self.close_connection = True
+            return
+        if firewall.drop():
+            firewall.count('dropped')
+            self.close_connection = True
+            return
+        if phase == ERROR:
+            firewall.count('errors')
+            self._send(503, b'<html><body>Service Unavailable</body></html>', 'text/html')
+            return
+        if not urllib.parse.urlsplit(self.path).path.rstrip('/') == '/api':
+            self._send(404, b'Not Found', 'text/plain')
+            return
+
+        status, body = firewall.api(params, phase)
+        self._send(status, body)
+
+    def _send(self, status, body, content_type='application/xml; charset=UTF-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakePanos(object):
+    """
+    A fake firewall serving the XML API on a local port
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, phases=None, latency=0.0, jitter=0.0, drop_rate=0.0,
+                 api_key=DEFAULT_API_KEY, username='admin', password='admin', commit_time=0.0, seed=None,
+                 sw_version=DEFAULT_SW_VERSION):
+        """
+        :param host: Address to listen on
+        :param port: Port to listen on, 0 picks a free port
+        :param phases: List of (phase, seconds) boot phases, the firewall is ready after the last one
+        :param latency: Seconds added to every call
+        :param jitter: Up to this many seconds are added at random to every call
+        :param drop_rate: Fraction of calls whose connection is closed without an answer
+        :param api_key: Key returned by keygen and required by every other call
+        :param username: Username accepted by keygen
+        :param password: Password accepted by keygen
+        :param commit_time: Seconds a commit job runs
+        :param seed: Random seed for the jitter and dropped connections
+        :param sw_version: PAN-OS version reported by show system info, multi-config needs 9.0 or later
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.api_key = api_key
+        self.username = username
+        self.password = password
+        self.commit_time = commit_time
+        self.sw_version = sw_version
+        self.random = random.Random(seed)
+        self.config = {}
+        self.running = {}
+        self.jobs = {}
+        self.stats = {}
+        self.lock = threading.RLock()
+        self.server = None
+        self.thread = None
+        self.certdir = None
+        self.reboot(phases)
+
+    @property
+    def address(self):
+        """Host and port of the API, as passed to the panosapi calls"""
+        return '{}:{}'.format(self.host, self.port)
+
+    def start(self):
+        self.certdir = tempfile.mkdtemp(prefix='fake-panos-')
+        certfile, keyfile = make_certificate(self.certdir)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+
+        self.server = _Server((self.host, self.port), _Handler)
+        self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+        self.server.firewall = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.certdir is not None:
+            shutil.rmtree(self.certdir, ignore_errors=True)
+            self.certdir = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def reboot(self, phases=None):
+        """
+        Starts the boot phases again.  The configuration is kept.
+
+        :param phases: List of (phase, seconds), None for a firewall that is ready straight away
+        """
+        for phase, seconds in phases or ():
+            if phase not in PHASES:
+                raise ValueError('Unknown phase {}'.format(phase))
+        with self.lock:
+            self.phases = list(phases or ())
+            self.booted = time.time()
+
+    def _phase_and_end(self):
+        end = self.booted
+        for phase, seconds in self.phases:
+            end += seconds
+            if time.time() < end:
+                return phase, end
+        return READY, None
+
+    def phase(self):
+        """The current boot phase"""
+        with self.lock:
+            return self._phase_and_end()[0]
+
+    def phase_remaining(self):
+        """Seconds left in the current boot phase"""
+        with self.lock:
+            end = self._phase_and_end()[1]
+        return MAX_HANG if end is None else max(end - time.time(), 0)
+
+    def version(self):
+        """The emulated PAN-OS version as a tuple of numbers"""
+        return tuple(int(part) for part in re.findall(r'\d+', self.sw_version.split('-')[0]))
+
+    def count(self, counter):
+        with self.lock:
+            self.stats[counter] = self.stats.get(counter, 0) + 1
+
+    def delay(self):
+        seconds = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if seconds:
+            time.sleep(seconds)
+
+    def drop(self):
+        with self.lock:
+            return self.drop_rate and self.random.random() < self.drop_rate
+
+    def api(self, params, phase):
+        """
+        Answers an API call
+
+        :param params: Dictionary of API parameters
+        :param phase: Current boot phase, ALMOST or READY
+        :return: Tuple of HTTP status and response body
+        """
+        call_type = params.get('type')
+        self.count(call_type or 'unknown')
+        self._finish_jobs()
+        if call_type == 'keygen':
+            if params.get('user') != self.username or params.get('password') != self.password:
+                return 403, error('Invalid credentials.', code=403)
+            return 200, response('<key>{}</key>'.format(self.api_key))
+        if params.get('key') != self.api_key:
+            return 403, error('Invalid Credential', code=403)
+
+        if call_type == 'op':
+            return self._op(params.get('cmd', ''), phase)
+        if call_type == 'config':
+            return self._config(params.get('action'), params.get('xpath', ''), params.get('element', ''))
+        if call_type == 'commit':
+            return self._commit()
+        return 200, error('Unknown type {}'.format(call_type), code=17)
+
+    def _op(self, cmd, phase):
+        try:
+            command = et.fromstring(cmd)
+        except et.ParseError:
+            return 200, error('Malformed command', code=17)
+        if command.tag == 'show' and command.find('chassis-ready') is not None:
+            return 200, response('yes' if phase == READY else 'no')
+        if command.tag == 'show' and command.find('system/info') is not None:
+            return 200, response('<system><hostname>fake-panos</hostname><sw-version>{}</sw-version></system>'.format(
+                escape(self.sw_version)))
+        job_id = command.findtext('jobs/id') if command.tag == 'show' else None
+        if job_id is not None:
+            return 200, self._job(job_id.strip())
+        return 200, error('Unknown command', code=17)
+
+    def _config(self, action, xpath, element):
+        with self.lock:
+            if action == 'multi-config':
+                if self.version() < (9, 0):
+                    self.count('config-multi-config-rejected')
+                    return 200, error('Invalid action multi-config', code=17)
+                return self._multi_config(element)
+            if action in ('get', 'show'):
+                config = self.config if action == 'get' else self.running
+                if xpath not in config:
+                    # PAN-OS answers a get of a missing node with an empty result and a show with an error
+                    if action == 'get':
+                        return 200, response('', code=7)
+                    return 200, error('No such node', code=7)
+                return 200, response(et.tostring(config[xpath]).decode('utf-8'), code=19)
+            try:
+                self._change(action, xpath, element)
+            except (ValueError, et.ParseError) as e:
+                return 200, error(str(e), code=17)
+            self.count('config-' + action)
+            return 200, message('command succeeded')
+
+    def _change(self, action, xpath, element):
+        """
+        Applies one set, edit or delete.  set merges the child elements into the node, edit replaces the node.
+        """
+        if action == 'set':
+            node = self.config.setdefault(xpath, xpath_node(xpath))
+            for child in et.fromstring('<set>{}</set>'.format(element)):
+                for old in [old for old in node if same_node(old, child)]:
+                    node.remove(old)
+                node.append(child)
+        elif action == 'edit':
+            self.config[xpath] = et.fromstring(element)
+        elif action == 'delete':
+            self.config.pop(xpath, None)
+        else:
+            raise ValueError('Unknown action {}'.format(action))
+
+    def _multi_config(self, element):
+        """
+        Applies every operation of a multi-config request, or none of them if one fails
+        """
+        saved = {xpath: copy.deepcopy(node) for xpath, node in self.config.items()}
+        results = []
+        try:
+            for operation in et.fromstring(element):
+                self._change(operation.tag, operation.get('xpath', ''), ''.join(
+                    et.tostring(child).decode('utf-8') for child in operation))
+                results.append('<response id="{}" status="success" code="20"><msg>command succeeded</msg>'
+                               '</response>'.format(operation.get('id')))
+        except (ValueError, et.ParseError) as e:
+            self.config = saved
+            return 200, error(str(e), code=17)
+        self.count('config-multi-config')
+        return 200, '<response status="success" code="20">{}</response>'.format(''.join(results)).encode('utf-8')
+
+    def _commit(self):
+        with self.lock:
+            candidate = {xpath: et.tostring(node) for xpath, node in self.config.items()}
+            pending = [snapshot for finish, snapshot in self.jobs.values() if snapshot is not None]
+            committed = pending[-1] if pending else self.running
+            if candidate == {xpath: et.tostring(node) for xpath, node in committed.items()}:
+                return 200, message('There are no changes to commit.', code=19)
+            job_id = len(self.jobs) + 1
+            self.jobs[job_id] = (time.time() + self.commit_time, copy.deepcopy(self.config))
+            self.count('commit-jobs')
+        return 200, response('<msg><line>Commit job enqueued with jobid {0}</line></msg><job>{0}</job>'.format(job_id),
+                             code=19)
+
+    def _finish_jobs(self):
+        """
+        Copies the configuration of every commit job that has finished to the running configuration
+        """
+        with self.lock:
+            for job_id in sorted(self.jobs):
+                finish, snapshot = self.jobs[job_id]
+                if snapshot is not None and time.time() >= finish:
+                    self.running = snapshot
+                    self.jobs[job_id] = (finish, None)
+
+    def _job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(int(job_id)) if job_id.isdigit() else None
+        if job is None:
+            return error('job {} not found'.format(job_id))
+        done = time.time() >= job[0]
+        return response('<job><id>{}</id><type>Commit</type><status>{}</status><result>{}</result>'
+                        '<progress>{}</progress><details><line>{}</line></details></job>'.format(
+                            job_id, 'FIN' if done else 'ACT', 'OK' if done else 'PEND', 100 if done else 50,
+                            'Configuration committed successfully' if done else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake PAN-OS XML API server')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8443, help='Port to listen on')
+    parser.add_argument('--no-answer', type=float, default=0, help='Seconds calls are not answered at start up')
+    parser.add_argument('--error', type=float, default=0, help='Seconds calls get HTTP 503 after that')
+    parser.add_argument('--almost', type=float, default=0, help='Seconds chassis-ready is no after that')
+    parser.add_argument('--latency', type=float, default=0, help='Milliseconds added to every call')
+    parser.add_argument('--jitter', type=float, default=0, help='Up to this many random milliseconds added')
+    parser.add_argument('--drop-rate', type=float, default=0, help='Fraction of connections dropped')
+    parser.add_argument('--commit-time', type=float, default=0, help='Seconds a commit job runs')
+    parser.add_argument('--api-key', default=DEFAULT_API_KEY, help='API key returned by keygen')
+    parser.add_argument('--sw-version', default=DEFAULT_SW_VERSION, help='PAN-OS version, multi-config needs 9.0')
+    args = parser.parse_args()
+
+    phases = [(phase, seconds) for phase, seconds in
+              ((NO_ANSWER, args.no_answer), (ERROR, args.error), (ALMOST, args.almost)) if seconds]
+    firewall = FakePanos(args.host, args.port, phases, latency=args.latency / 1000.0, jitter=args.jitter / 1000.0,
+                         drop_rate=args.drop_rate, api_key=args.api_key, commit_time=args.commit_time,
+                         sw_version=args.sw_version)
+    firewall.start()
+    print('Fake PAN-OS API on https://{}/api/ with key {}'.format(firewall.address, firewall.api_key))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        firewall.stop()
+        print('Stats {}'.format(firewall.stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Benchmarks the PAN-OS probe and initialisation paths against local fake firewalls (benchmarks/fake_panos.py).
+
+Scenarios:
+
+    probe  Probes --firewalls firewalls for --rounds rounds, one at a time and with panosapi.probe_many(), and
+           reports the p50 and p99 time of a round.
+    boot   Probes a booting firewall every --interval seconds with the route monitor get_firewall_status() and
+           reports how long after the firewall became ready it was seen as ready.
+    init   Runs the InitialiseFwLambda updateTGWFirewall() and panCommit() against --firewalls firewalls and
+           reports the time of each step.
+
+Usage: python benchmarks/panos_api.py probe [--firewalls 4] [--rounds 50] [--latency 20] [--drop-rate 0]
+       python benchmarks/panos_api.py boot [--no-answer 5] [--error 3] [--almost 5] [--interval 1]
+       python benchmarks/panos_api.py init [--firewalls 2] [--latency 20] [--commit-time 0]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bootstrap', 'lambda',
+                                'lambda-combined'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import panosapi  # noqa: E402
+from fake_panos import ALMOST, ERROR, NO_ANSWER, FakePanos  # noqa: E402
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def report(name, seconds):
+    print('{:<28} n={:<5} p50={:8.1f} ms  p99={:8.1f} ms  max={:8.1f} ms'.format(
+        name, len(seconds), percentile(seconds, 0.5) * 1000, percentile(seconds, 0.99) * 1000, max(seconds) * 1000))
+
+
+def start_firewalls(args, phases=None):
+    return [FakePanos(phases=phases, latency=args.latency / 1000.0, jitter=args.jitter / 1000.0,
+                      drop_rate=args.drop_rate, commit_time=args.commit_time, seed=i,
+                      sw_version=args.sw_version).start()
+            for i in range(args.firewalls)]
+
+
+def probe(args):
+    firewalls = start_firewalls(args)
+    hosts = {'fw{}'.format(i + 1): fw.address for i, fw in enumerate(firewalls)}
+    api_key = firewalls[0].api_key
+    try:
+        sequential = []
+        for _ in range(args.rounds):
+            start = time.time()
+            for host in hosts.values():
+                panosapi.chassis_ready(host, api_key)
+            sequential.append(time.time() - start)
+
+        concurrent = []
+        not_ready = 0
+        for _ in range(args.rounds):
+            start = time.time()
+            status = panosapi.probe_many(hosts, api_key, deadline=args.deadline)
+            concurrent.append(time.time() - start)
+            not_ready += sum(1 for result in status.values() if not result.ready)
+    finally:
+        for fw in firewalls:
+            fw.stop()
+
+    report('Sequential probe round', sequential)
+    report('probe_many round', concurrent)
+    print('Probes not ready {} of {}, pool {}'.format(not_ready, args.rounds * len(hosts), panosapi.get_stats()))
+
+
+def boot(args):
+    import TransitGatewayRouteMonitorLambda as monitor
+
+    phases = [(phase, seconds) for phase, seconds in
+              ((NO_ANSWER, args.no_answer), (ERROR, args.error), (ALMOST, args.almost)) if seconds]
+    boot_time = sum(seconds for phase, seconds in phases)
+    args.firewalls = 1
+    fw, = start_firewalls(args, phases)
+    try:
+        start = time.time()
+        seen = []
+        while True:
+            status = monitor.get_firewall_status(fw.address, fw.api_key, timeout=args.timeout)
+            seen.append((round(time.time() - start, 1), fw.phase(), status))
+            if status == 'running':
+                break
+            time.sleep(args.interval)
+        detected = time.time() - start
+    finally:
+        fw.stop()
+
+    for elapsed, phase, status in seen:
+        print('{:>7.1f}s  phase {:<10} probe {}'.format(elapsed, phase, status))
+    print('Ready after {:.1f} secs, seen as ready after {:.1f} secs ({:.1f} secs late), {} probes, stats {}'.format(
+        boot_time, detected, detected - boot_time, len(seen), fw.stats))
+
+
+def init(args):
+    import InitialiseFwLambda as initialise
+
+    firewalls = start_firewalls(args)
+    steps = {'updateTGWFirewall': [], 'panCommit': []}
+    try:
+        for fw in firewalls:
+            start = time.time()
+            initialise.updateTGWFirewall('10.0.0.0/8', fw.address, '10.0.1.10', fw.api_key, '10.0.2.0/24',
+                                         'Fw-Untrust-Int')
+            steps['updateTGWFirewall'].append(time.time() - start)
+            start = time.time()
+            initialise.panCommit(fw.address, fw.api_key, message='benchmark')
+            steps['panCommit'].append(time.time() - start)
+    finally:
+        for fw in firewalls:
+            fw.stop()
+
+    for name, seconds in steps.items():
+        report(name, seconds)
+    print('Firewall calls {}, pool {}'.format(firewalls[0].stats, panosapi.get_stats()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the PAN-OS API paths against fake firewalls')
+    parser.add_argument('scenario', choices=['probe', 'boot', 'init'])
+    parser.add_argument('--firewalls', type=int, default=2, help='Number of fake firewalls')
+    parser.add_argument('--rounds', type=int, default=50, help='Probe rounds')
+    parser.add_argument('--deadline', type=float, default=5, help='Deadline of a probe_many round in seconds')
+    parser.add_argument('--latency', type=float, default=20, help='Milliseconds added to every call')
+    parser.add_argument('--jitter', type=float, default=0, help='Up to this many random milliseconds added')
+    parser.add_argument('--drop-rate', type=float, default=0, help='Fraction of connections dropped')
+    parser.add_argument('--commit-time', type=float, default=0, help='Seconds a commit job runs')
+    parser.add_argument('--sw-version', default='8.1.0', help='PAN-OS version of the fake firewalls')
+    parser.add_argument('--no-answer', type=float, default=5, help='Boot seconds without an answer')
+    parser.add_argument('--error', type=float, default=3, help='Boot seconds answering HTTP 503')
+    parser.add_argument('--almost', type=float, default=5, help='Boot seconds with chassis-ready no')
+    parser.add_argument('--interval', type=float, default=1, help='Seconds between boot probes')
+    parser.add_argument('--timeout', type=float, default=2, help='Timeout of a boot probe')
+    args = parser.parse_args()
+
+    {'probe': probe, 'boot': boot, 'init': init}[args.scenario](args)
+
+
+if __name__ == '__main__':
+    main()
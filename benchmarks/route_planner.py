@@ -0,0 +1,86 @@
+"""
+Benchmarks the route planner against synthetic route tables.
+
+Builds random route tables with routes spread across the firewalls, runs plan_route_changes() for random
+firewall health and checks that no route is left on, or moved to, a firewall that is down, and that a route on a
+healthy firewall is only moved when the policy places its prefix.  With more than two
+firewalls the pool policy is used and the prefixes are spread by hashing.
+
+Usage: python benchmarks/route_planner.py [--tables 5000] [--routes 50] [--firewalls 2]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bootstrap', 'lambda',
+                                'lambda-combined'))
+
+from routeplanner import build_policy, build_pool_policy, is_placed, plan_route_changes  # noqa: E402
+from routetable import RouteTableView  # noqa: E402
+
+VPC_SUMMARY_ROUTE = '10.0.0.0/8'
+
+
+def synthetic_route_table(rng, route_count, firewall_enis):
+    routes = [{'DestinationCidrBlock': '192.168.0.0/16', 'GatewayId': 'local', 'State': 'active'}]
+    cidrs = ['0.0.0.0/0', VPC_SUMMARY_ROUTE] + ['10.{}.{}.0/24'.format(i // 256, i % 256)
+                                               for i in range(route_count - 2)]
+    for cidr in cidrs:
+        eni = rng.choice(sorted(firewall_enis.values()))
+        routes.append({'DestinationCidrBlock': cidr, 'NetworkInterfaceId': eni,
+                       'State': rng.choice(['active', 'blackhole'])})
+    return RouteTableView('rtb-synthetic', routes)
+
+
+def check_plan(route_view, fw_status, firewall_enis, policy, changes):
+    down_enis = set(firewall_enis[name] for name, status in fw_status.items() if status != 'running')
+    if len(down_enis) == len(firewall_enis):
+        assert not changes, 'Routes changed with no healthy firewall'
+        return
+    moved = set(change.cidr for change in changes)
+    for change in changes:
+        assert change.desired_eni not in down_enis, 'Route moved to a failed firewall'
+        if change.current_eni is not None and change.current_eni not in down_enis:
+            assert is_placed(change.cidr, policy), 'Route {} moved off a healthy firewall'.format(change.cidr)
+    for eni in down_enis:
+        for cidr in route_view.cidrs_via(eni):
+            assert cidr in moved, 'Route {} left on a failed firewall'.format(cidr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the route planner')
+    parser.add_argument('--tables', type=int, default=5000, help='Number of synthetic route tables')
+    parser.add_argument('--routes', type=int, default=50, help='Firewall routes per route table')
+    parser.add_argument('--firewalls', type=int, default=2, help='Number of firewalls')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    args = parser.parse_args()
+
+    firewall_enis = {'fw{}'.format(i + 1): 'eni-fw{}'.format(i + 1) for i in range(args.firewalls)}
+    rng = random.Random(args.seed)
+    cases = []
+    for _ in range(args.tables):
+        fw_status = {name: rng.choice(['running', 'running', 'down']) for name in firewall_enis}
+        if args.firewalls > 2:
+            policy = build_pool_policy([], rng.choice(['yes', 'no']))
+        else:
+            policy = build_policy(VPC_SUMMARY_ROUTE, rng.choice(['yes', 'no']), rng.choice(['yes', 'no']))
+        cases.append((synthetic_route_table(rng, args.routes, firewall_enis), fw_status, policy))
+
+    changes_total = 0
+    start = time.perf_counter()
+    plans = [plan_route_changes(view, fw_status, firewall_enis, policy) for view, fw_status, policy in cases]
+    elapsed = time.perf_counter() - start
+
+    for (view, fw_status, policy), changes in zip(cases, plans):
+        check_plan(view, fw_status, firewall_enis, policy, changes)
+        changes_total += len(changes)
+
+    print('Planned {} route tables of {} routes in {:.3f} secs ({:.1f} usec per table), {} route changes'.format(
+        args.tables, args.routes, elapsed, elapsed / args.tables * 1e6, changes_total))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,12 @@
-import boto3
-import boto3
 import cfnresponse
 import sys
 import logging
 from botocore.exceptions import ClientError
 from time import sleep
 
+from awsclients import get_client
+from metrics import MetricsLogger
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
@@ -15,16 +16,25 @@ logger.setLevel(logging.INFO)
 
 MAX_RETRIES = 5
 
-client = boto3.client('ec2')
+client = None
 responseData = {}
 
+metrics = MetricsLogger('DeleteLambdaEni')
+
 
 def handler(event, context):
+    try:
+        delete_lambda_enis(event, context)
+    finally:
+        metrics.flush()
+
+
+def delete_lambda_enis(event, context):
     global client
 
     vpc_id = event['ResourceProperties']['VPCID']
     region = event['ResourceProperties']['region']
-    client = boto3.client('ec2', region_name=region)
+    client = get_client('ec2', region_name=region)
     logger.info("Got event {}".format(event))
 
     if event['RequestType'] == 'Create' or event['RequestType'] == 'Update':
@@ -35,34 +45,37 @@ def handler(event, context):
         return
     try:
         # Get all network interfaces for given vpc which are attached to a lambda function
-        interfaces = client.describe_network_interfaces(
-            Filters=[
-                {
-                    'Name': 'description',
-                    'Values': ['AWS Lambda VPC ENI*']
-                },
-                {
-                    'Name': 'vpc-id',
-                    'Values': [vpc_id]
-                },
-            ],
-        )
+        with metrics.phase('DescribeInterfaces'):
+            interfaces = client.describe_network_interfaces(
+                Filters=[
+                    {
+                        'Name': 'description',
+                        'Values': ['AWS Lambda VPC ENI*']
+                    },
+                    {
+                        'Name': 'vpc-id',
+                        'Values': [vpc_id]
+                    },
+                ],
+            )
         logger.info("Found these interface {}".format(interfaces))
         failed_detach = list()
         failed_delete = list()
 
         # Detach the above found network interfaces
-        for interface in interfaces['NetworkInterfaces']:
-            logger.info("Detaching interface {} from {}".format(interface, interfaces))
-            detach_interface(failed_detach, interface)
+        with metrics.phase('DetachInterfaces'):
+            for interface in interfaces['NetworkInterfaces']:
+                logger.info("Detaching interface {} from {}".format(interface, interfaces))
+                detach_interface(failed_detach, interface)
 
         sleep(20)
 
         # Try detach a second time and delete each simultaneously
-        for interface in interfaces['NetworkInterfaces']:
-            logger.info("20secs later 2nd try detaching interface {} from {}".format(interface, interfaces))
-            detach_and_delete_interface(failed_detach, failed_delete, interface)
-            logger.info("Got exception detaching interface {} from {}".format(interface, interfaces))
+        with metrics.phase('DeleteInterfaces'):
+            for interface in interfaces['NetworkInterfaces']:
+                logger.info("20secs later 2nd try detaching interface {} from {}".format(interface, interfaces))
+                detach_and_delete_interface(failed_detach, failed_delete, interface)
+                logger.info("Got exception detaching interface {} from {}".format(interface, interfaces))
 
         if not failed_detach or not failed_delete:
             result = {'result': 'Network interfaces detached and deleted successfully'}
@@ -8,37 +8,55 @@ Use at your own risk.
 """
 
 import logging
-import ssl
-import urllib
-import xml
 import os
-import netaddr
-import xml.etree.ElementTree as et
-import boto3
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 
 from botocore.exceptions import ClientError
 
+import cidrutil
+import panosapi
+import subnetcache
+from awsclients import get_client
+from metrics import MetricsLogger
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-lambda_client = boto3.client('lambda')
-ec2_client = boto3.client('ec2')
-gcontext = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
-
 subnets = []
 
+metrics = MetricsLogger('InitialiseFwLambda')
+
+# Invocations of the step function before it gives up on a firewall that is not up.  The step function waits
+# between panosapi.MIN_WAIT and panosapi.MAX_WAIT secs between invocations, so the time is limited as well.
+DEFAULT_MAX_ATTEMPTS = 150
+DEFAULT_MAX_WAIT_SECS = 2700
+# Seconds left for returning the result before the function times out
+COMMIT_WAIT_MARGIN = 15
+# Seconds an invocation works on the firewalls when there is no Lambda context
+DEFAULT_INVOCATION_SECS = 75
+
+COMPLETED = 'completed'
+
+
+class FWNotUpException(Exception):
+    """
+    Raised when the firewall is not ready.  state is the chassis-ready probe state
+    """
+
+    def __init__(self, message, state=panosapi.NO_ANSWER):
+        super(FWNotUpException, self).__init__(message)
+        self.state = state
+
 
 def find_subnet_by_id( subnet_id):
     """
-    find a subnet by subnet ID. Sets a Filter based on the subnet_id and calls find_classic_subnet()
+    find a subnet by subnet ID. The subnet is cached in the warm container by subnetcache
     :param subnet_id: 
 
     """
-    kwargs = {
-        'SubnetIds': [subnet_id]
-    }
-    return find_classic_subnet(kwargs)
+    return subnetcache.get_subnet(subnet_id)
 
 
 def find_subnet_by_block(cidr):
@@ -60,7 +78,7 @@ def find_classic_subnet(kwargs):
     logger.info("Querying for subnet")
     logger.debug("calling ec2.describe_subnets with args: %s", kwargs)
     try:
-        subnets = ec2_client.describe_subnets(**kwargs)['Subnets']
+        subnets = get_client('ec2').describe_subnets(**kwargs)['Subnets']
     except ClientError:
         logger.debug("No Classic subnet found matching query.")
         return None
@@ -74,7 +92,7 @@ def find_classic_subnet(kwargs):
     return subnets[0]
 
 
-def updateRouteNexthop(route, hostname, api_key, subnetGateway, virtualRouter="default"):
+def updateRouteNexthop(route, hostname, api_key, subnetGateway, virtualRouter="default", batch=None):
     """
     Updates the firewall route table with the next hop of the default gateway in the AWS subnet
 
@@ -82,6 +100,7 @@ def updateRouteNexthop(route, hostname, api_key, subnetGateway, virtualRouter="d
     :param api_key:
     :param subnetGateway: AWS subnet gateway (First IP in the subnet range)
     :param virtualRouter: VR where we wish to apply this route
+    :param batch: panosapi.ConfigBatch to add the change to rather than sending it straight away
     :return: Result of API request
     """
     xpath = "/config/devices/entry[@name='localhost.localdomain']/network/" \
@@ -89,7 +108,8 @@ def updateRouteNexthop(route, hostname, api_key, subnetGateway, virtualRouter="d
     element = "<destination>{0}</destination><interface>ethernet1/2" \
               "</interface><nexthop><ip-address>{1}</ip-address></nexthop>".format(route, subnetGateway)
 
-
+    if batch is not None:
+        return batch.set(xpath, element)
     return panSetConfig(hostname, api_key, xpath, element)
 
 
@@ -118,8 +138,9 @@ def panEditConfig(hostname, api_key, xpath, element):
 
 def makeApiCall(hostname, data):
     """
-    Makes the API call to the firewall interface.  We turn off certificate checking before making the API call.
-    Returns the API response from the firewall.
+    Makes the API call to the firewall interface with the shared PAN-OS client, which reuses the pooled
+    keep-alive connection and retries calls that fail to reach the firewall.  Certificate checking is turned
+    off by panosapi.  Returns the API response from the firewall.
     :param hostname:
     :param data:
     :return: Expected response
@@ -130,13 +151,7 @@ def makeApiCall(hostname, data):
     </response>
     """
 
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    # No certificate check
-    ctx.verify_mode = ssl.CERT_NONE
-    url = "https://" + hostname + "/api"
-    encoded_data = urllib.parse.urlencode(data).encode('utf-8')
-    return urllib.request.urlopen(url, data=encoded_data, context=ctx).read()
+    return panosapi.call(hostname, data, panosapi.CONFIG_POLICY)
 
 
 def panSetConfig(hostname, api_key, xpath, element):
@@ -157,12 +172,15 @@ def panSetConfig(hostname, api_key, xpath, element):
 
 
 
-def editIpObject(hostname, api_key, objectname, address):
+def editIpObject(hostname, api_key, objectname, address, batch=None):
     """Function to edit/update an existing IP Address object on a PA Node
+    If a panosapi.ConfigBatch is passed the change is added to it rather than sent straight away
     """
     xpath = "/config/devices/entry[@name='localhost.localdomain']/vsys/entry[@name='vsys1']/address/entry[@name='{0}']/ip-netmask".format(
         objectname)
     element = "<ip-netmask>{0}</ip-netmask>".format(address)
+    if batch is not None:
+        return batch.edit(xpath, element)
     return panEditConfig(hostname, api_key, xpath, element)
 
 
@@ -170,34 +188,34 @@ def getApiKey(hostname, username, password):
     """Generate API keys using username/password
     API Call: http(s)://hostname/api/?type=keygen&user=username&password=password
     """
-    data = {
-        'type': 'keygen',
-        'user': username,
-        'password': password
-    }
-    response = makeApiCall(hostname, data)
-    if response == 'error':
-        logger.info("Got error making api call to get api key!")
-        return response
-    else:
-        return xml.etree.ElementTree.XML(response)[0][0].text
+    try:
+        return panosapi.keygen(hostname, username, password, panosapi.CONFIG_POLICY)
+    except panosapi.PanApiError as e:
+        logger.info("Got error {} making api call to get api key!".format(e))
+        return 'error'
 
 
-def panCommit(hostname, api_key, message=""):
+def panCommit(hostname, api_key, message="", policy=panosapi.CONFIG_POLICY):
     """Function to commit configuration changes
+    Returns the id of the commit job or None if there was nothing to commit
     """
-    data = {
-        "type": "commit",
-        "key": api_key,
-        "cmd": "<commit>{0}</commit>".format(message)
-    }
-    return makeApiCall(hostname, data)
+    return panosapi.commit(hostname, api_key, message, policy)
+
+
+def config_policy(deadline):
+    """
+    :param deadline: Time, in seconds since the epoch, by which the invocation must be done with the firewall
+    :return: panosapi.CONFIG_POLICY limited so that no call or retry runs past the deadline
+    """
+    return panosapi.RetryPolicy(attempts=panosapi.CONFIG_POLICY.attempts, timeout=panosapi.CONFIG_POLICY.timeout,
+                                backoff=panosapi.CONFIG_POLICY.backoff, deadline=max(deadline - time.time(), 1))
 
 
 def get_gw_ip(cidr):
-    ip = netaddr.IPNetwork(cidr)
-    iplist = list(ip)
-    return iplist[1]
+    """
+    Returns the gateway of the subnet, the first IP after the network address
+    """
+    return cidrutil.gateway_ip(cidr)
 
 
 def getFirewallStatus(gwMgmtIp, api_key):
@@ -206,48 +224,15 @@ def getFirewallStatus(gwMgmtIp, api_key):
     :param gwMgmtIp:  IP Address of firewall interface to be probed
     :param api_key:  Panos API key
     """
-    global gcontext
-
-    cmd = urllib.request.Request("https://" + gwMgmtIp + "/api/?type=op&cmd=<show><chassis-ready></chassis-ready></show>&key=" + api_key)
     # Send command to fw and see if it times out or we get a response
-    logger.info('[INFO]: Sending command: %s', cmd)
-    try:
-        response = urllib.request.urlopen(cmd, data=None, context=gcontext, timeout=5).read()
-        #Now we do stuff to the gw
-    except urllib.error.URLError:
-        logger.info("[INFO]: No response from FW. So maybe not up!")
-        return 'no'
-        #sleep and check again?
-    else:
-        logger.info("[INFO]: FW is up!!")
-
-    logger.info("[RESPONSE]: {}".format(response))
-    resp_header = et.fromstring(response)
-
-    if resp_header.tag != 'response':
-        logger.info("[ERROR]: didn't get a valid response from firewall...maybe a timeout")
-        return 'cmd_error'
-
-    if resp_header.attrib['status'] == 'error':
-        logger.info("[ERROR]: Got an error for the command")
-        return 'cmd_error'
-
-    if resp_header.attrib['status'] == 'success':
-        # The fw responded with a successful command execution. So is it ready?
-        for element in resp_header:
-            if element.text.rstrip() == 'yes':
-                # Call config gw command?
-                logger.info("[INFO]: FW is ready for configure")
-                return 'yes'
-            else:
-                return 'almost'
-            # The fw is still not ready to accept commands
-            # so invoke lambda again and do this all over? Or just retry command?
-
-
-
-
-def updateTGWFirewall(vpc_summary_route, fw_trust_ip, fw_untrust_ip, api_key, trustAZ_subnet_cidr, fw_untrust_int):
+    logger.info('[INFO]: Sending command show chassis-ready to %s', gwMgmtIp)
+    status = panosapi.chassis_ready(gwMgmtIp, api_key)
+    logger.info("[INFO]: FW status is {}: {}".format(status.state, status.detail))
+    return status.state
+
+
+def updateTGWFirewall(vpc_summary_route, fw_trust_ip, fw_untrust_ip, api_key, trustAZ_subnet_cidr, fw_untrust_int,
+                      policy=panosapi.CONFIG_POLICY):
     """
     Parse the repsonse from makeApiCall()
     :param fw_trust_ip:
@@ -255,31 +240,31 @@ def updateTGWFirewall(vpc_summary_route, fw_trust_ip, fw_untrust_ip, api_key, tr
     :param api_key:
     :param trustAZ_subnet_cidr:
     :param fw_untrust_int:
-    :return:
+    :param policy: RetryPolicy of the config reads and the push
+    :return: True if the config was changed and needs a commit, False if the firewall was already configured
     If we see the string 'yes' in the repsonse we will assume that the firewall is up and continue with the firewall
     configuration
     """
 
-    class FWNotUpException(Exception):
-        pass
     err = 'no'
     while (True):
-        err = getFirewallStatus(fw_trust_ip, api_key)
+        with metrics.phase('ReadinessProbe'):
+            err = getFirewallStatus(fw_trust_ip, api_key)
         if err == 'cmd_error':
             logger.info("[ERROR]: Command error from fw ")
-            raise FWNotUpException('FW is not up!  Request Timeout')
+            raise FWNotUpException('FW is not up!  Request Timeout', err)
             # terminate('false')
             # return
         elif err == 'no':
             # logger.info("[INFO] FW is not up...yet")
             # time.sleep(60)
             # continue
-            raise FWNotUpException('FW is not up!')
+            raise FWNotUpException('FW is not up!', err)
         elif err == 'almost':
             # this means autocommit is happening
             # time.sleep(10)
             # continue
-            raise FWNotUpException('FW is not up. Nic responds but DP not ready!')
+            raise FWNotUpException('FW is not up. Nic responds but DP not ready!', err)
         elif err == 'yes':
             logger.info("[INFO]: FW is up")
             break
@@ -287,36 +272,154 @@ def updateTGWFirewall(vpc_summary_route, fw_trust_ip, fw_untrust_ip, api_key, tr
     # Get the gateway IP for the trust subnet
     trustAZ_subnet_gw = get_gw_ip(trustAZ_subnet_cidr)
 
+    # All the changes are sent to the firewall in one multi-config request
+    batch = panosapi.ConfigBatch()
+
     # Update the route table with a static route
-    updateRouteNexthop(vpc_summary_route,fw_trust_ip, api_key, trustAZ_subnet_gw, virtualRouter="default")
+    updateRouteNexthop(vpc_summary_route,fw_trust_ip, api_key, trustAZ_subnet_gw, virtualRouter="default",
+                       batch=batch)
 
     # Update an address object of the firewall.
-    editIpObject(fw_trust_ip, api_key, fw_untrust_int, fw_untrust_ip)
+    editIpObject(fw_trust_ip, api_key, fw_untrust_int, fw_untrust_ip, batch=batch)
 
+    # Only push when the running config differs so that a retry does not queue another commit
+    changes = batch.changes(fw_trust_ip, api_key, policy=policy)
+    if not changes:
+        logger.info("[INFO]: FW {} is already configured".format(fw_trust_ip))
+        return False
+    changes.push(fw_trust_ip, api_key, policy=policy)
+    return True
 
 
-def lambda_handler(event, context):
 
+def initialiseFirewall(fw, vpc_summary_route, api_key, fw_untrust_int, job_id=None, deadline=None):
+    """
+    Configures and commits one firewall.  A commit started by an earlier invocation is polled rather than repeated.
+    :param fw: Dictionary with the name, trust_ip, untrust_ip, trust_subnet and trust_subnet_cidr of the firewall
+    :param vpc_summary_route:
+    :param api_key:
+    :param fw_untrust_int:
+    :param job_id: Commit job started by an earlier invocation
+    :param deadline: Time, in seconds since the epoch, by which the configuration calls and the wait for the commit
+    job must be done.  DEFAULT_INVOCATION_SECS from now if not set
+    :return: Tuple of the state and the id of the commit job that is still running.  The state is COMPLETED,
+    panosapi.COMMITTING or the chassis-ready state of a firewall that is not up
+    """
+    deadline = deadline or time.time() + DEFAULT_INVOCATION_SECS
+    try:
+        if job_id is None:
+            with metrics.phase('UpdateConfig', Firewall=fw['name']):
+                changed = updateTGWFirewall(vpc_summary_route, fw['trust_ip'], fw['untrust_ip'], api_key,
+                                            fw['trust_subnet_cidr'], fw_untrust_int, config_policy(deadline))
+            if changed:
+                with metrics.phase('Commit', Firewall=fw['name']):
+                    job_id = panCommit(fw['trust_ip'], api_key, message="Updated route table and address object",
+                                       policy=config_policy(deadline))
+
+        if job_id is not None:
+            # The time left is worked out now, after the configuration calls
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                logger.info("[INFO]: No time left to wait for commit job {} on firewall {}".format(
+                    job_id, fw['name']))
+                return panosapi.COMMITTING, job_id
+            with metrics.phase('CommitWait', Firewall=fw['name']):
+                job = panosapi.wait_for_job(fw['trust_ip'], api_key, job_id, remaining)
+            if not job.finished:
+                logger.info("[INFO]: Commit job {} on firewall {} is still running".format(job_id, fw['name']))
+                return panosapi.COMMITTING, job_id
+            if not job.succeeded:
+                logger.info("[ERROR]: Commit job {} on firewall {} failed {}".format(job_id, fw['name'], job.details))
+                return panosapi.CMD_ERROR, None
+    except FWNotUpException as e:
+        logger.info("[INFO]: Firewall {} is pending: {}".format(fw['name'], e))
+        return e.state, job_id
+    except panosapi.PanApiError as e:
+        logger.info("[INFO]: Firewall {} is pending: {}".format(fw['name'], e))
+        return panosapi.COMMITTING if job_id else panosapi.CMD_ERROR, job_id
+    logger.info("[INFO]: Firewall {} is initialised".format(fw['name']))
+    return COMPLETED, None
+
+
+def lambda_handler(event, context):
+    """
+    Initialises both firewalls at the same time.  The step function passes the output of one invocation to the
+    next, so a firewall that was initialised by an earlier invocation is skipped and only the pending firewalls
+    are retried.
+
+    :param event: Output of the previous invocation, empty on the first invocation
+    :param context:
+    :return: Dictionary with the completed and pending firewalls, the commit jobs still running, the readiness of
+    the pending firewalls, the attempt number, the seconds the step function waits before the next attempt and done
+    once all are completed
+    """
     logger.info("Got Event {}".format(event))
     vpc_summary_route = os.environ['VpcSummaryRoute']
-    fw1_trust_ip = os.environ['fw1TrustIp']
-    fw2_trust_ip = os.environ['fw2TrustIp']
-    fw1_untrust_ip = os.environ['fw1UntrustIp']
-    fw2_untrust_ip = os.environ['fw2UntrustIp']
-    trustAZ1_subnet = os.environ['trustAZ1Subnet']
-    trustAZ2_subnet = os.environ['trustAZ2Subnet']
     api_key = os.environ['apikey']
+    max_attempts = int(os.environ.get('MaxAttempts') or DEFAULT_MAX_ATTEMPTS)
+    max_wait_secs = int(os.environ.get('MaxWaitSecs') or DEFAULT_MAX_WAIT_SECS)
+    firewalls = [
+        {'name': 'fw1', 'trust_ip': os.environ['fw1TrustIp'], 'untrust_ip': os.environ['fw1UntrustIp'],
+         'trust_subnet': os.environ['trustAZ1Subnet']},
+        {'name': 'fw2', 'trust_ip': os.environ['fw2TrustIp'], 'untrust_ip': os.environ['fw2UntrustIp'],
+         'trust_subnet': os.environ['trustAZ2Subnet']},
+    ]
 
     fw_untrust_int = 'Fw-Untrust-Int'
 
-    trustAZ1_subnet_cidr = find_subnet_by_id(trustAZ1_subnet)['CidrBlock']
-    logger.info('Trust AZ1 subnet is {}'.format(trustAZ1_subnet_cidr))
-    trustAZ2_subnet_cidr = find_subnet_by_id(trustAZ2_subnet)['CidrBlock']
-    logger.info('Trust AZ2 subnet is {}'.format(trustAZ2_subnet_cidr))
-
-    updateTGWFirewall(vpc_summary_route,fw1_trust_ip, fw1_untrust_ip, api_key, trustAZ1_subnet_cidr, fw_untrust_int)
-    panCommit(fw1_trust_ip, api_key, message="Updated route table and address object")
-    updateTGWFirewall(vpc_summary_route,fw2_trust_ip, fw2_untrust_ip, api_key, trustAZ2_subnet_cidr, fw_untrust_int)
-    panCommit(fw2_trust_ip, api_key, message="Updated route table and address object")
-    logger.info("Failed to commit Firewall update")
-    logger.info("Updated Firewalls")
+    event = event if isinstance(event, dict) else {}
+    completed = set(event.get('completed', []))
+    jobs = dict(event.get('jobs', {}))
+    readiness = dict(event.get('readiness', {}))
+    attempt = event.get('attempt', 0) + 1
+    started = event.get('started') or time.time()
+    pending = [fw for fw in firewalls if fw['name'] not in completed]
+    # Leave time to return the result before the function times out
+    remaining = context.get_remaining_time_in_millis() / 1000.0 if context else DEFAULT_INVOCATION_SECS
+    deadline = time.time() + remaining - COMMIT_WAIT_MARGIN
+
+    try:
+        if pending:
+            # One describe_subnets call for all the firewalls, and none once the subnets are cached
+            with metrics.phase('DescribeSubnets'):
+                subnets = subnetcache.describe_subnets([fw['trust_subnet'] for fw in pending])
+            for fw in pending:
+                fw['trust_subnet_cidr'] = subnets[fw['trust_subnet']]['CidrBlock']
+                logger.info('Trust subnet of {} is {}'.format(fw['name'], fw['trust_subnet_cidr']))
+
+            with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                futures = {fw['name']: executor.submit(initialiseFirewall, fw, vpc_summary_route, api_key,
+                                                       fw_untrust_int, jobs.get(fw['name']), deadline)
+                           for fw in pending}
+                for name, future in futures.items():
+                    state, job_id = future.result()
+                    if state == COMPLETED:
+                        completed.add(name)
+                        readiness.pop(name, None)
+                    else:
+                        readiness[name] = panosapi.observe(readiness.get(name), state).as_dict()
+                    if job_id is None:
+                        jobs.pop(name, None)
+                    else:
+                        jobs[name] = job_id
+
+        result = {
+            'completed': sorted(completed),
+            'pending': sorted(fw['name'] for fw in firewalls if fw['name'] not in completed),
+            'jobs': jobs,
+            'readiness': readiness,
+            'attempt': attempt,
+            'started': started,
+        }
+        # The step function waits for the firewall that is expected to be ready first
+        result['wait_seconds'] = min([readiness[name]['wait'] for name in result['pending'] if name in readiness]
+                                     or [panosapi.MIN_WAIT])
+        result['done'] = not result['pending']
+        logger.info("Firewall initialisation {}".format(result))
+        logger.info("PAN-OS connection pool {}".format(panosapi.get_stats()))
+        if not result['done'] and (attempt >= max_attempts or time.time() - started >= max_wait_secs):
+            raise FWNotUpException('Firewalls {} are not up after {} attempts in {:.0f} secs'.format(
+                result['pending'], attempt, time.time() - started))
+        return result
+    finally:
+        metrics.flush()
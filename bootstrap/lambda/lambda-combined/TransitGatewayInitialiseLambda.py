@@ -16,10 +16,12 @@ Use at your own risk.
 
 import logging
 import os
-import boto3
 import cfnresponse
 import sys
 
+from awsclients import get_client
+from metrics import MetricsLogger
+
 
 
 logger = logging.getLogger()
@@ -27,6 +29,8 @@ logger.setLevel(logging.INFO)
 
 defroutecidr = '0.0.0.0/0'
 
+metrics = MetricsLogger('TransitGatewayInitialiseLambda')
+
 
 
 def add_route_tgw_nh(route_table_id, destination_cidr_block, transit_gateway_id):
@@ -37,9 +41,7 @@ def add_route_tgw_nh(route_table_id, destination_cidr_block, transit_gateway_id)
     :param transit_gateway_id:
     :return:
     """
-    ec2 = boto3.client('ec2')
-
-    resp = ec2.create_route(
+    resp = get_client('ec2').create_route(
         DryRun=False,
         RouteTableId=route_table_id,
         DestinationCidrBlock=destination_cidr_block,
@@ -55,8 +57,7 @@ def delete_route(route_table_id, destination_cidr_block):
     :param destination_cidr_block:
     :return:
     """
-    ec2 = boto3.client('ec2')
-    resp = ec2.delete_route(
+    resp = get_client('ec2').delete_route(
         DestinationCidrBlock=destination_cidr_block,
         RouteTableId=route_table_id,
     )
@@ -64,7 +65,7 @@ def delete_route(route_table_id, destination_cidr_block):
     return resp
 
 def start_state_function(state_machine_arn):
-    sfnConnection = boto3.client('stepfunctions')
+    sfnConnection = get_client('stepfunctions')
     sfnConnection.start_execution(stateMachineArn=state_machine_arn)
     if sfnConnection.list_executions(stateMachineArn=state_machine_arn, statusFilter='RUNNING')[
         'executions']:
@@ -95,36 +96,41 @@ def lambda_handler(event, context):
 
     responseData = {}
     responseData['data'] = 'Success'
-    if event['RequestType'] == 'Create':
-        if VPC0_route_table_id != 'Null':
-            resp = add_route_tgw_nh(VPC0_route_table_id, defroutecidr, transit_gateway_id)
-            logger.info("Got response to route update on VPC0 {} ".format(resp))
-        if VPC0_route_table_id != 'Null':
-            resp1 = add_route_tgw_nh(VPC1_route_table_id, defroutecidr, transit_gateway_id)
-            logger.info("Got response to route update on VPC1 {} ".format(resp1))
-        
-        res2 = add_route_tgw_nh(toTGWRouteTable, vnetroutecidr, transit_gateway_id)
-        logger.info("Got response to route update on SecVPC {} ".format(res2))
-
-        start_resp = start_state_function(init_fw_state_machine_arn)
-        logger.info("Calling start state function {} ".format(start_resp))
-        cfnresponse.send(event, context, cfnresponse.SUCCESS, responseData, "CustomResourcePhysicalID")
-        logger.info("Sending cfn success message ")
-
-    elif event['RequestType'] == 'Update':
-        print("Update something")
-
-    elif event['RequestType'] == 'Delete':
-        print("Got Delete event")
-        try:
-            res = delete_route(toTGWRouteTable, vnetroutecidr)
-            res1 = delete_route(VPC0_route_table_id, defroutecidr)
-
-
-        except Exception as e:
-            print("Errory trying to delete something")
+    try:
+        if event['RequestType'] == 'Create':
+            with metrics.phase('AddRoutes'):
+                if VPC0_route_table_id != 'Null':
+                    resp = add_route_tgw_nh(VPC0_route_table_id, defroutecidr, transit_gateway_id)
+                    logger.info("Got response to route update on VPC0 {} ".format(resp))
+                if VPC0_route_table_id != 'Null':
+                    resp1 = add_route_tgw_nh(VPC1_route_table_id, defroutecidr, transit_gateway_id)
+                    logger.info("Got response to route update on VPC1 {} ".format(resp1))
+
+                res2 = add_route_tgw_nh(toTGWRouteTable, vnetroutecidr, transit_gateway_id)
+                logger.info("Got response to route update on SecVPC {} ".format(res2))
+
+            with metrics.phase('StartStateMachine'):
+                start_resp = start_state_function(init_fw_state_machine_arn)
+            logger.info("Calling start state function {} ".format(start_resp))
             cfnresponse.send(event, context, cfnresponse.SUCCESS, responseData, "CustomResourcePhysicalID")
+            logger.info("Sending cfn success message ")
+
+        elif event['RequestType'] == 'Update':
+            print("Update something")
+
+        elif event['RequestType'] == 'Delete':
+            print("Got Delete event")
+            try:
+                with metrics.phase('DeleteRoutes'):
+                    res = delete_route(toTGWRouteTable, vnetroutecidr)
+                    res1 = delete_route(VPC0_route_table_id, defroutecidr)
+
 
+            except Exception as e:
+                print("Errory trying to delete something")
+                cfnresponse.send(event, context, cfnresponse.SUCCESS, responseData, "CustomResourcePhysicalID")
+    finally:
+        metrics.flush()
 
 if __name__=='__main__':
  if len(sys.argv)==2 and sys.argv[1]=='--help':
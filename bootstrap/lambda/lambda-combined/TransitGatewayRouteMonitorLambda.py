@@ -27,175 +27,369 @@ This software is provided without support, warranty, or guarantee.
 Use at your own risk.
 """
 
+import json
 import logging
 import os
-import ssl
-import urllib
-import xml.etree.ElementTree as et
-
-import boto3
-from botocore.exceptions import ClientError
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import panosapi
+from awsclients import get_client
+from healthstate import HealthTracker, LocalFileStateStore, MemoryStateStore, SsmStateStore
+from healthstate import DEFAULT_DOWN_THRESHOLD, DEFAULT_HOLD_DOWN, DEFAULT_UP_THRESHOLD, DOWN
+from metrics import MetricsLogger
+from routeplanner import build_policy, build_pool_policy, plan_route_changes
+from routetable import RouteTableView, apply_next_hops
 
 secfw = {}
 prifw = {}
 
 event = {}
 context = {}
-gcontext = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
-
-ec2 = boto3.resource('ec2')
 
-ec2_client = boto3.client('ec2')
-client = boto3.client('ec2')
-events_client = boto3.client('events')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Shared deadline in seconds for one round of firewall health probes
+PROBE_DEADLINE = 5
+# Polling mode defaults.  The poll window stays below the 1 minute schedule so that runs do not overlap
+DEFAULT_POLL_WINDOW = 50
+# Seconds left for the final route update before the Lambda times out
+POLL_TIMEOUT_MARGIN = 15
+# Environment variables that every deployment of the Deployments list inherits.  The route tables, firewalls and
+# instance ids identify the host stack and are never inherited.
+SHARED_SETTINGS = ('apikey', 'preempt', 'splitroutes', 'PollInterval', 'PollWindow', 'HealthStateParameter',
+                   'HealthStateFile', 'HealthUpThreshold', 'HealthDownThreshold', 'HealthHoldDown')
+
+# EC2 instance states that mean the firewall is going away
+INSTANCE_DOWN_STATES = ('shutting-down', 'stopping', 'stopped', 'terminated')
+
+# Maximum number of deployments monitored at the same time
+DEFAULT_MAX_CONCURRENCY = 10
+
+metrics = MetricsLogger('TransitGatewayRouteMonitorLambda')
+
+# Health state used when no persistent store is configured, one per deployment.  It survives warm invocations only.
+memory_state_stores = {}
 
-def check_for_split_routes(route_table_id, vpc_summary_route, def_route):
+
+def get_firewall_status(gwMgmtIp, api_key, timeout=PROBE_DEADLINE):
     """
-    Checks the route table if split_routes == True and if both the vpc_summary and Default point to the same eni
-    Return False else Return True.  When split routes is True we want to use both firewalls.  Firewall 1 for internet
-    traffic and firewall 2 for east/west traffic.
+     Reruns the status of the firewall.  Calls the op command show chassis status
+     Requires an apikey and the IP address of the interface we send the api request
+     :param gwMgmtIp:
+     :param api_key:
+     :param timeout: Seconds to wait for the firewall to answer
+     :return: 'running' if the firewall is ready otherwise 'down'
+     """
+    logger.info('[INFO]: Sending command show chassis-ready to {}'.format(gwMgmtIp))
+    status = panosapi.chassis_ready(gwMgmtIp, api_key, panosapi.RetryPolicy(attempts=1, timeout=timeout))
+    logger.info("[INFO]: FW with address {} is {}: {}".format(gwMgmtIp, status.state, status.detail))
+    return 'running' if status.ready else 'down'
+
+
+def probe_firewalls(firewalls, api_key, deadline=PROBE_DEADLINE):
+    """
+    Probes every firewall at the same time and waits at most deadline seconds for the whole round.
+    A firewall that has not answered when the deadline expires is reported as 'down' so the decision
+    latency is bounded by the slowest single probe rather than the sum of all probes.  The round trip
+    time of each probe is recorded as the ProbeRTT metric of the firewall.
+
+    :param firewalls: Dictionary of firewall name to trust interface IP address
+    :param api_key: Panos API key
+    :param deadline: Seconds to wait for all probes to complete
+    :return: Dictionary of firewall name to status ('running' or 'down')
+    """
+    status = {}
+    for name, result in panosapi.probe_many(firewalls, api_key, deadline).items():
+        metrics.put('ProbeRTT', result.elapsed * 1000, Firewall=name)
+        if not result.ready:
+            logger.info("[INFO]: Firewall {} is {}: {}".format(name, result.state, result.detail))
+        status[name] = 'running' if result.ready else 'down'
 
-    :param route_table_id:  The route table that we will modify.
-    :param vpc_summary_route:  A summary route used to forward all east west traffic to the alternative firewall if
-    required
-    :param def_route: The default route in this case 0.0.0.0/0
-    :param route_table_id: route table the we need to check
-    :return: True/False
+    logger.info("[INFO]: Firewall status {}".format(status))
+    return status
 
+
+def update_routes(fw_status, settings, started=None):
+    """
+    Updates the route tables for the current firewall status.  The route planner works out the next hop of every
+    prefix routed to the firewalls, failing over the prefixes of a firewall that is down and failing back when
+    preempt is set, and only the routes that need to change are replaced.  All the route tables of the deployment
+    are read with one describe_route_tables call.
+
+    :param fw_status: Dictionary of firewall name to status
+    :param settings: Dictionary of route monitor settings read by get_settings()
+    :param started: Time the change in firewall status was first seen, used for the FailoverConvergence metric
+    :return: List of RouteChange that were applied
+    """
+    policy = get_policy(settings)
+    firewall_enis = {fw['name']: fw['eni'] for fw in settings['firewalls']}
+
+    running = [name for name, status in fw_status.items() if status == 'running']
+    if not running:
+        logger.info("No firewall is running - routes are left unchanged")
+        return []
+    if len(running) == len(fw_status) and not policy['preempt'] and not policy['prefixes']:
+        logger.info("All firewalls running - exiting and we cannot failback")
+        return []
+
+    dimensions = deployment_dimensions(settings)
+    all_changes = []
+    with metrics.phase('DescribeRouteTables', **dimensions):
+        route_views = RouteTableView.snapshot_many(get_client('ec2'), settings['route_table_ids'])
+    for route_table_id, route_view in sorted(route_views.items()):
+        with metrics.phase('PlanRoutes', **dimensions):
+            changes = plan_route_changes(route_view, fw_status, firewall_enis, policy)
+        for change in changes:
+            logger.info("Moving route {} in {} from {} to {}".format(change.cidr, route_table_id, change.current_eni,
+                                                                    change.desired_eni))
+        if changes:
+            with metrics.phase('ReplaceRoutes', **dimensions):
+                apply_next_hops(get_client('ec2'), route_view, {change.cidr: change.desired_eni for change in changes})
+        all_changes.extend(changes)
+
+    if all_changes and started is not None:
+        metrics.put('FailoverConvergence', (time.time() - started) * 1000, **dimensions)
+    return all_changes
+
+
+def deployment_dimensions(settings):
     """
-    vpc_summary_route_eni = ''
-    def_route_eni = ''
-    route_table = ec2_client.describe_route_tables(RouteTableIds=[route_table_id])
-    Interfaceids = []
-    routes = route_table['RouteTables'][0]['Routes']
-    for route in routes:
-        key = 'NetworkInterfaceId'
-        if key in route:
-            eni1 = route['NetworkInterfaceId']
-            if route['DestinationCidrBlock'] == vpc_summary_route:
-                vpc_summary_route_eni = eni1
-            elif route['DestinationCidrBlock'] == def_route:
-                def_route_eni = eni1
-    if vpc_summary_route_eni == def_route_eni:
-        logger.info("Both routes use eni {0}".format(def_route_eni))
+    :param settings: Dictionary of route monitor settings read by get_settings()
+    :return: Metric dimensions that identify the deployment when several deployments are monitored
+    """
+    return {'Deployment': settings['name']} if settings['name'] else {}
+
+
+def poll_for_failure(firewalls, api_key, settings, context, tracker):
+    """
+    Keeps probing the firewalls every poll_interval seconds until the poll window or the Lambda timeout is
+    close.  As soon as the health tracker confirms that a firewall has gone down the routes are failed over,
+    so a failure is acted on within seconds rather than at the next scheduled run.
+
+    :param firewalls: Dictionary of firewall name to trust interface IP address
+    :param api_key: Panos API key
+    :param settings: Dictionary of route monitor settings read by get_settings()
+    :param context: Lambda context used to find the remaining execution time
+    :param tracker: HealthTracker holding the firewall health state
+    :return: True if routes were failed over
+    """
+    poll_interval = settings['poll_interval']
+    window = settings['poll_window']
+    if hasattr(context, 'get_remaining_time_in_millis'):
+        window = min(window, context.get_remaining_time_in_millis() / 1000.0 - POLL_TIMEOUT_MARGIN)
+    deadline = time.time() + window
+
+    while time.time() + poll_interval + PROBE_DEADLINE < deadline:
+        time.sleep(poll_interval)
+        started = time.time()
+        with metrics.phase('Probe', **deployment_dimensions(settings)):
+            transitions = tracker.update(probe_firewalls(firewalls, api_key))
+        if any(state == DOWN for name, state in transitions):
+            confirmed = tracker.confirmed_status(firewalls)
+            logger.info("[INFO]: Confirmed firewall failure {}".format(confirmed))
+            update_routes(confirmed, settings, started)
+            return True
+    return False
+
+
+def is_instance_state_event(event):
+    """
+    :param event: Lambda event
+    :return: True if the event is an EC2 instance state-change notification from CloudWatch Events
+    """
+    return isinstance(event, dict) and event.get('source') == 'aws.ec2' \
+        and event.get('detail-type') == 'EC2 Instance State-change Notification'
+
+
+def handle_instance_state_event(event, settings, tracker):
+    """
+    Fails over the routes of a firewall as soon as its instance starts stopping or terminating rather than
+    waiting for a later probe to time out.  Other instance states are left to the health probes.
+
+    :param event: EC2 instance state-change notification
+    :param settings: Dictionary of route monitor settings read by get_settings()
+    :param tracker: HealthTracker holding the firewall health state
+    :return: True if routes were failed over
+    """
+    instance_id = event['detail'].get('instance-id')
+    state = event['detail'].get('state')
+    instances = {fw.get('instance'): fw['name'] for fw in settings['firewalls'] if fw.get('instance')}
+    name = instances.get(instance_id)
+    logger.info("[INFO]: Instance {} is {}".format(instance_id, state))
+    if name is None or state not in INSTANCE_DOWN_STATES:
         return False
+
+    tracker.mark_down(name)
+    update_routes(tracker.confirmed_status([fw['name'] for fw in settings['firewalls']]), settings,
+                  event_time(event))
+    return True
+
+
+def event_time(event):
+    """
+    :param event: CloudWatch event
+    :return: Time of the event in seconds since the epoch, or now if the event has no valid time
+    """
+    try:
+        return datetime.strptime(event['time'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return time.time()
+
+
+def get_health_tracker(settings):
+    """
+    Creates the health tracker with the state store selected by the settings.  A local file is used when
+    HealthStateFile is set, an SSM parameter when HealthStateParameter is set, otherwise the state is only kept
+    in the warm container.  When several deployments are monitored each one keeps its state in its own file or
+    parameter, named after the deployment.
+
+    :param settings: Dictionary of route monitor settings read by get_settings()
+    :return: HealthTracker
+    """
+    name = settings['name']
+    if settings['health_state_file']:
+        path = settings['health_state_file']
+        store = LocalFileStateStore('{}.{}'.format(path, name) if name else path)
+    elif settings['health_state_parameter']:
+        parameter = settings['health_state_parameter']
+        store = SsmStateStore(get_client('ssm'), '{}/{}'.format(parameter, name) if name else parameter)
     else:
-        return True
+        store = memory_state_stores.setdefault(name, MemoryStateStore())
+    return HealthTracker(store, up_threshold=settings['health_up_threshold'],
+                         down_threshold=settings['health_down_threshold'], hold_down=settings['health_hold_down'])
+
 
+def get_policy(settings):
+    """
+    Builds the routing policy.  A pool of firewalls spreads every prefix across the firewalls, the firewall pair
+    prefers firewall 1 for the default route and, with split routes, firewall 2 for the VPC summary route.
 
-def replace_vpc_route_to_fw(route_table_id, destination_cidr_block, NetworkInterfaceId, DryRun=False):
+    :param settings: Dictionary of route monitor settings read by get_settings()
+    :return: Policy dictionary
     """
-    Scan the route table for blackhole routes where the next hop is the eni of the failed firewall.
-    In order to replace the routes we first delete the route and then add a new route pointing to the
-    backup eni.
+    if settings['pool']:
+        return build_pool_policy(settings['spoke_prefixes'], settings['preempt'])
+    policy = build_policy(settings['vpc_summary_route'], settings['split_routes'], settings['preempt'])
+    policy['prefixes'] = settings['spoke_prefixes']
+    return policy
 
-    :param route_table_id: The route table that requires modification
-    :param destination_cidr_block: The cidr block that we need to change.  Normally the default route and VPC summary route
-    :param NetworkInterfaceId: The eni of the Firewall that we need to failover to
-    :param DryRun: Perform a DryRun - Doesn't update the route table
-    :return: Respone to route_create or 'None'
 
+def get_firewalls(environ):
     """
+    Reads the firewalls from the Firewalls variable, a json list of objects with name, eni, ip and optionally
+    instance.  Without it the firewall pair is read from the fw1 and fw2 variables.
 
-    try:
-        ec2_client.delete_route(
-            DestinationCidrBlock=destination_cidr_block,
-            RouteTableId=route_table_id
-        )
-        logger.info("Success deleting {0} route".format(destination_cidr_block))
-    except ClientError as e:
-        logger.info("Got error {0} deleting route Moving on.".format(e))
-        return None
+    :param environ: Environment variables or deployment settings
+    :return: List of firewall dictionaries
+    """
+    firewalls = environ.get('Firewalls')
+    if firewalls:
+        return json.loads(firewalls) if isinstance(firewalls, str) else firewalls
+    return [
+        {'name': 'fw1', 'eni': environ['fw1Trusteni'], 'ip': environ['fw1Trustip'],
+         'instance': environ.get('Fw1InstanceId')},
+        {'name': 'fw2', 'eni': environ['fw2Trusteni'], 'ip': environ['fw2Trustip'],
+         'instance': environ.get('Fw2InstanceId')},
+    ]
+
+
+def get_list(value):
+    """
+    :param value: List or comma separated string
+    :return: List of non empty strings
+    """
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
 
-    try:
-        resp = ec2_client.create_route(
-            DryRun=False,
-            DestinationCidrBlock=destination_cidr_block,
-            RouteTableId=route_table_id,
-            NetworkInterfaceId=NetworkInterfaceId
-        )
-        logger.info("Success adding {} route next hop {}".format(destination_cidr_block, NetworkInterfaceId))
-    except ClientError as e:
-        logger.info("Got error {0} adding route Moving on.".format(e))
-        return None
-    return resp
-
-
-def failover(route_table_id, failed_eni, backup_eni):
+
+def get_settings(environ=os.environ, name=''):
     """
-    Looks for routes that are blackholed by the failure of the firewall
-    When it finds a route it will call replace_vpc_route_to_fw to update the next hop to a functional eni
+    Reads the route monitor settings from the environment variables.  The settings of a deployment in the
+    Deployments list use the same names as the environment variables and override them.
 
-    :param route_table_id: The route table that requires modification
-    :param failed_eni: NetworkInterfaceId: The eni of the Firewall that has failed
-    :param backup_eni: NetworkInterfaceId: The eni of the Firewall that we need to failover to
-    :return:
+    :param environ: Environment variables or deployment settings
+    :param name: Deployment name, empty when a single deployment is monitored
+    :return: Dictionary of settings
+    """
+    return {
+        'name': name,
+        'preempt': environ['preempt'],
+        'vpc_summary_route': environ.get('VpcSummaryRoute'),
+        'route_table_ids': get_list(environ.get('RouteTableIds')) or [environ['fromTGWRouteTableId']],
+        'api_key': environ['apikey'],
+        'split_routes': environ.get('splitroutes', 'no'),
+        'firewalls': get_firewalls(environ),
+        'pool': bool(environ.get('Firewalls')),
+        'spoke_prefixes': get_list(environ.get('SpokePrefixes')),
+        'poll_interval': float(environ.get('PollInterval', 0)),
+        'poll_window': float(environ.get('PollWindow', DEFAULT_POLL_WINDOW)),
+        'health_state_parameter': environ.get('HealthStateParameter'),
+        'health_state_file': environ.get('HealthStateFile'),
+        'health_up_threshold': int(environ.get('HealthUpThreshold', DEFAULT_UP_THRESHOLD)),
+        'health_down_threshold': int(environ.get('HealthDownThreshold', DEFAULT_DOWN_THRESHOLD)),
+        'health_hold_down': float(environ.get('HealthHoldDown', DEFAULT_HOLD_DOWN)),
+    }
+
+
+def get_deployments(event):
     """
+    Reads the deployments to monitor from the 'deployments' key of the event or the Deployments environment
+    variable, a json list where each entry overrides the environment variables for one deployment.  Without
+    either a single deployment is read from the environment variables.
 
-    route_table = ec2_client.describe_route_tables(RouteTableIds=[route_table_id])
-    Interfaceids = []
-    routes = route_table['RouteTables'][0]['Routes']
-    for route in routes:
-        key = 'NetworkInterfaceId'
-        if key in route:
-            eni1 = route['NetworkInterfaceId']
-            if route['NetworkInterfaceId'] == failed_eni:
-                logger.info("Found route {} with blackhole next hop {}".format(failed_eni,
-                                                                               route['DestinationCidrBlock']))
-                destination_cidr_block = route['DestinationCidrBlock']
-                replace_vpc_route_to_fw(route_table_id, destination_cidr_block, backup_eni, DryRun=False)
-
-
-def get_firewall_status(gwMgmtIp, api_key):
+    A deployment only inherits the SHARED_SETTINGS variables.  Its route tables and firewalls must be given in the
+    entry, and its instance ids are empty unless the entry sets them, so that it never acts on the host stack.
+
+    :param event: Lambda event
+    :return: List of settings dictionaries
     """
-     Reruns the status of the firewall.  Calls the op command show chassis status
-     Requires an apikey and the IP address of the interface we send the api request
-     :param gwMgmtIp:
-     :param api_key:
-     :return:
-     """
+    deployments = event.get('deployments') if isinstance(event, dict) else None
+    if deployments is None and os.environ.get('Deployments'):
+        deployments = json.loads(os.environ['Deployments'])
+    if not deployments:
+        return [get_settings()]
+
+    all_settings = []
+    for index, deployment in enumerate(deployments):
+        name = deployment.get('name', 'deployment-{}'.format(index))
+        environ = {key: os.environ[key] for key in SHARED_SETTINGS if key in os.environ}
+        environ.update(deployment)
+        try:
+            all_settings.append(get_settings(environ, name=name))
+        except KeyError as e:
+            raise ValueError("Deployment {} has no {} setting".format(name, e))
+    return all_settings
 
-    global gcontext
-    # cmd = urllib.request.Request('https://google.com')
-    cmd = urllib.request.Request(
-        "https://" + gwMgmtIp + "/api/?type=op&cmd=<show><chassis-ready></chassis-ready></show>&key=" + api_key)
-    # Send command to fw and see if it times out or we get a response
-    logger.info('[INFO]: Sending command: {}'.format(cmd))
-    try:
-        response = urllib.request.urlopen(cmd, data=None, context=gcontext, timeout=5).read()
-        logger.info(
-            "[INFO]:Got http 200 response from FW with address {}. So need to check the response".format(gwMgmtIp))
-        # Now we do stuff to the gw
-    except urllib.error.URLError:
-        logger.info("[INFO]: No response from FW with address {}. So maybe not up!".format(gwMgmtIp))
-        return 'down'
-        # sleep and check again?
-    else:
-        logger.info("[INFO]: FW is responding!!")
-
-    logger.info("[RESPONSE]: {}".format(response))
-    resp_header = et.fromstring(response)
-
-    if resp_header.tag != 'response':
-        logger.info("[ERROR]: didn't get a valid response from firewall...maybe a timeout")
-        return 'down'
-
-    if resp_header.attrib['status'] == 'error':
-        logger.info("[ERROR]: Got response header error for the command")
-        return 'down'
-
-    if resp_header.attrib['status'] == 'success':
-        # The fw responded with a successful command execution
-        for element in resp_header:
-            if element.text.rstrip() == 'yes':
-                # Call config gw command?
-                logger.info("[INFO]: FW with ip {} is ready ".format(gwMgmtIp))
-                return 'running'
-    else:
-        return 'down'
+
+def monitor_deployment(settings, event, context):
+    """
+    Probes the firewalls of one deployment and reconciles its route tables
+
+    :param settings: Dictionary of route monitor settings read by get_settings()
+    :param event: Lambda event
+    :param context: Lambda context
+    :return:
+    """
+    firewalls = {fw['name']: fw['ip'] for fw in settings['firewalls']}
+    api_key = settings['api_key']
+
+    tracker = get_health_tracker(settings)
+
+    if is_instance_state_event(event):
+        handle_instance_state_event(event, settings, tracker)
+        return
+
+    started = time.time()
+    with metrics.phase('Probe', **deployment_dimensions(settings)):
+        tracker.update(probe_firewalls(firewalls, api_key))
+    update_routes(tracker.confirmed_status(firewalls), settings, started)
+
+    if settings['poll_interval'] > 0:
+        poll_for_failure(firewalls, api_key, settings, context, tracker)
 
 
 def lambda_handler(event, context):
@@ -217,66 +411,56 @@ def lambda_handler(event, context):
     api_key = os.environ['apikey']
     split_routes = os.environ['splitroutes'] Select True if you intend to use both firewalls One for east/West and
     one for internet.
+    fw1_instance_id = os.environ['Fw1InstanceId'] Fw 1 instance id.  Routes are failed over straight away when an EC2
+    instance state-change event reports that the instance is stopping or terminating.
+    fw2_instance_id = os.environ['Fw2InstanceId'] Fw 2 instance id.
+    firewalls = os.environ['Firewalls'] Optional. Json list of firewalls, each with name, eni, ip and instance, that
+    replaces the fw1 and fw2 variables with a pool of any size.  Prefixes are spread across the healthy firewalls
+    of the pool by consistent hashing.
+    spoke_prefixes = os.environ['SpokePrefixes'] Optional. Comma separated prefixes to route through the firewalls,
+    they are added to the route table when missing.
+    route_table_ids = os.environ['RouteTableIds'] Optional. Comma separated route tables to reconcile instead of
+    fromTGWRouteTableId.
+    deployments = os.environ['Deployments'] Optional. Json list of deployments that are probed and reconciled in
+    parallel.  Each sets its own route tables and firewalls and inherits only apikey, preempt, splitroutes and the
+    poll and health settings.  A 'deployments' list in the event takes precedence.
+    max_concurrency = os.environ['MaxConcurrency'] Optional. Maximum number of deployments monitored at the same time.
+    poll_interval = os.environ['PollInterval'] Optional. Seconds between probes when the function keeps polling the
+    firewalls within one invocation.  0 or unset probes once per invocation.
+    poll_window = os.environ['PollWindow'] Optional. Seconds to keep polling, keep this below the schedule rate.
+    health_state_parameter = os.environ['HealthStateParameter'] Optional. SSM parameter holding the firewall health
+    state.  health_state_file = os.environ['HealthStateFile'] keeps it in a local file instead.
+    health_up_threshold = os.environ['HealthUpThreshold'] Optional. Good probes before a failed firewall is used again.
+    health_down_threshold = os.environ['HealthDownThreshold'] Optional. Failed probes before a firewall is failed over.
+    health_hold_down = os.environ['HealthHoldDown'] Optional. Minimum seconds before a failed firewall is used again.
     :param event:
     :param context:
     :return:
     '''
 
-    preempt = os.environ['preempt']
-    vpc_summary_route = os.environ['VpcSummaryRoute']
-    fw1_trust_eni = os.environ['fw1Trusteni']
-    fw2_trust_eni = os.environ['fw2Trusteni']
-    route_table_id = os.environ['fromTGWRouteTableId']
-    fw1_trust_ip = os.environ['fw1Trustip']
-    fw2_trust_ip = os.environ['fw2Trustip']
-    api_key = os.environ['apikey']
-    split_routes = os.environ['splitroutes']
-
-    def_route = '0.0.0.0/0'
-
-    global gcontext
-
-    prifwstatus = get_firewall_status(gwMgmtIp=fw1_trust_ip, api_key=api_key)
-    secfwstatus = get_firewall_status(gwMgmtIp=fw2_trust_ip, api_key=api_key)
-
-    if (split_routes) == 'yes':
-        def_route_nic = fw1_trust_eni
-        vpc_summary_nic = fw2_trust_eni
-    else:
-        def_route_nic = fw1_trust_eni
-        vpc_summary_nic = fw1_trust_eni
+    start = time.time()
+    try:
+        deployments = get_deployments(event)
+        max_concurrency = int(os.environ.get('MaxConcurrency', DEFAULT_MAX_CONCURRENCY))
 
-    if ((prifwstatus == 'running') and (secfwstatus == 'running')):
-        if preempt == 'no':
-            logger.info("Both firewalls running - exiting and we cannot failback")
-            exit()
+        if len(deployments) == 1:
+            monitor_deployment(deployments[0], event, context)
         else:
-            """
-            Call split_routes to check if we need to modify routes so that both firewalls are securing 
-            traffic.  If split_routes == True but check_for_split_routes returns False then we need to failback
-            
-            """
-            if split_routes == 'yes':
-                if check_for_split_routes(route_table_id, vpc_summary_route, def_route) == False:
-                    logger.info("Both firewalls running and we can failback")
-
-                    replace_vpc_route_to_fw(route_table_id, vpc_summary_route, vpc_summary_nic, DryRun=False)
-                    replace_vpc_route_to_fw(route_table_id, def_route, def_route_nic, DryRun=False)
-
-    elif ((prifwstatus != 'running') and (secfwstatus == 'running')):
-        try:
-            failover(route_table_id, fw1_trust_eni, fw2_trust_eni)
-            logger.info("Failing over all routes to firewall 2")
-
-        except Exception as e:
-            logger.info("Disassociation Fail [RESPONSE]: {}".format(e))
-
-    elif ((prifwstatus == 'running') and (secfwstatus != 'running')):
-        logger.info("Failing over all routes to firewall 1")
-        try:
-            failover(route_table_id, fw2_trust_eni, fw1_trust_eni)
-        except Exception as e:
-            logger.info("Disassociation Fail [RESPONSE]: {}".format(e))
+            if any(settings['poll_interval'] > 0 for settings in deployments) and len(deployments) > max_concurrency:
+                logger.info("[INFO]: Polling {} deployments with {} workers, the other deployments wait for a free "
+                            "worker".format(len(deployments), max_concurrency))
+            with ThreadPoolExecutor(max_workers=min(len(deployments), max_concurrency)) as executor:
+                futures = {executor.submit(monitor_deployment, settings, event, context): settings['name']
+                           for settings in deployments}
+                for future, name in futures.items():
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.info("[ERROR]: Monitoring deployment {} failed with {}".format(name, e))
+        logger.info("[INFO]: PAN-OS connection pool {}".format(panosapi.get_stats()))
+    finally:
+        metrics.put('Duration', (time.time() - start) * 1000, Phase='Total')
+        metrics.flush()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,46 @@
+"""
+Palo Alto Networks awsclients.py
+
+Lazy, memoized boto3 clients shared by the Lambda functions.
+
+boto3 is only imported and a client is only built the first time a function asks for it, so the cold start of a
+function only pays for the clients it actually uses.  The clients are kept for the life of the container and reused
+by warm invocations and by every thread of an invocation.
+
+This software is provided without support, warranty, or guarantee.
+Use at your own risk.
+"""
+
+import threading
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(service_name, region_name=None):
+    """
+    Returns the boto3 client for a service, creating it on first use
+
+    :param service_name: AWS service name, for example 'ec2'
+    :param region_name: Region of the client, the region of the function is used if not set
+    :return: boto3 client
+    """
+    key = (service_name, region_name)
+    client = _clients.get(key)
+    if client is None:
+        # Creating clients from the default session is not thread safe
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                import boto3
+                client = boto3.client(service_name, region_name=region_name)
+                _clients[key] = client
+    return client
+
+
+def reset():
+    """
+    Drops every cached client so that the next call builds a new one
+    """
+    with _lock:
+        _clients.clear()
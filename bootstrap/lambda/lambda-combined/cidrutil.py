@@ -0,0 +1,85 @@
+"""
+Palo Alto Networks cidrutil.py
+
+Facts about IPv4 subnets computed arithmetically with the standard library ipaddress module.
+
+Nothing here builds the list of addresses in a subnet, so the time and memory used are the same for a /28 and
+a /8.  AWS reserves the first four addresses and the last address of every subnet: the network address, the VPC
+router (the gateway), the DNS server, one reserved for future use and the broadcast address.
+
+This software is provided without support, warranty, or guarantee.
+Use at your own risk.
+"""
+
+import ipaddress
+
+# Addresses that AWS reserves at the start of every subnet
+AWS_RESERVED_FIRST = 4
+
+
+def network(cidr):
+    """
+    :param cidr: Subnet in CIDR notation, host bits may be set
+    :return: ipaddress.IPv4Network
+    """
+    return ipaddress.ip_network(cidr, strict=False)
+
+
+def network_address(cidr):
+    """
+    :param cidr: Subnet in CIDR notation
+    :return: The network address as a string
+    """
+    return str(network(cidr).network_address)
+
+
+def gateway_ip(cidr):
+    """
+    The VPC router of an AWS subnet is the network address plus one
+
+    :param cidr: Subnet in CIDR notation
+    :return: The gateway address as a string
+    """
+    return str(network(cidr).network_address + 1)
+
+
+def dns_ip(cidr):
+    """
+    :param cidr: Subnet in CIDR notation
+    :return: The address of the Amazon DNS server in the subnet, the network address plus two
+    """
+    return str(network(cidr).network_address + 2)
+
+
+def broadcast_address(cidr):
+    """
+    :param cidr: Subnet in CIDR notation
+    :return: The last address of the subnet as a string
+    """
+    return str(network(cidr).broadcast_address)
+
+
+def usable_range(cidr):
+    """
+    :param cidr: Subnet in CIDR notation
+    :return: Tuple of the first and last address that AWS lets instances use
+    """
+    subnet = network(cidr)
+    return str(subnet.network_address + AWS_RESERVED_FIRST), str(subnet.broadcast_address - 1)
+
+
+def usable_count(cidr):
+    """
+    :param cidr: Subnet in CIDR notation
+    :return: Number of addresses that AWS lets instances use
+    """
+    return max(network(cidr).num_addresses - AWS_RESERVED_FIRST - 1, 0)
+
+
+def contains(cidr, address):
+    """
+    :param cidr: Subnet in CIDR notation
+    :param address: IP address
+    :return: True if the address is in the subnet
+    """
+    return ipaddress.ip_address(address) in network(cidr)
@@ -0,0 +1,220 @@
+"""
+Palo Alto Networks healthstate.py
+
+Health state machine with hysteresis for the firewalls watched by the route monitor.
+
+Each firewall is either 'up' or 'down'.  A firewall that is up is only marked down after down_threshold
+consecutive failed probes, and a firewall that is down is only marked up again after up_threshold
+consecutive good probes and once it has been down for at least hold_down seconds.  Routes are only changed
+for the confirmed state so a flapping firewall does not cause route churn.
+
+The state is kept in a store so that it is shared between warm and cold invocations.  SsmStateStore keeps
+it in an SSM parameter, LocalFileStateStore in a json file for tests and MemoryStateStore in the warm
+container only.  Every change reads the latest state first and only the records of the firewalls it changed are
+written back, so the polling invocation and an instance state event handled at the same time do not undo each
+other's changes.
+
+This software is provided without support, warranty, or guarantee.
+Use at your own risk.
+"""
+
+import json
+import logging
+import time
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+UP = 'up'
+DOWN = 'down'
+
+DEFAULT_UP_THRESHOLD = 3
+DEFAULT_DOWN_THRESHOLD = 2
+DEFAULT_HOLD_DOWN = 180
+
+
+class MemoryStateStore(object):
+    """
+    Keeps the state in memory.  The state survives warm invocations only.
+    """
+
+    def __init__(self):
+        self.state = {}
+
+    def load(self):
+        return json.loads(json.dumps(self.state))
+
+    def save(self, state):
+        self.state = json.loads(json.dumps(state))
+
+
+class LocalFileStateStore(object):
+    """
+    Keeps the state in a local json file
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as data:
+                return json.load(data)
+        except FileNotFoundError:
+            return {}
+
+    def save(self, state):
+        with open(self.path, 'w') as data:
+            json.dump(state, data)
+
+
+class SsmStateStore(object):
+    """
+    Keeps the state in an SSM parameter so that it is shared by every invocation of the function
+    """
+
+    def __init__(self, ssm_client, parameter_name):
+        self.ssm_client = ssm_client
+        self.parameter_name = parameter_name
+
+    def load(self):
+        try:
+            response = self.ssm_client.get_parameter(Name=self.parameter_name)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ParameterNotFound':
+                return {}
+            raise
+        return json.loads(response['Parameter']['Value'])
+
+    def save(self, state):
+        self.ssm_client.put_parameter(Name=self.parameter_name, Value=json.dumps(state), Type='String',
+                                      Overwrite=True)
+
+
+class HealthTracker(object):
+    """
+    Applies probe results to the persisted health state of every firewall
+    """
+
+    def __init__(self, store, up_threshold=DEFAULT_UP_THRESHOLD, down_threshold=DEFAULT_DOWN_THRESHOLD,
+                 hold_down=DEFAULT_HOLD_DOWN, clock=time.time):
+        """
+        :param store: State store with load() and save(state) methods
+        :param up_threshold: Consecutive good probes before a firewall that is down is marked up
+        :param down_threshold: Consecutive failed probes before a firewall that is up is marked down
+        :param hold_down: Minimum seconds a firewall stays down before it can be marked up again
+        :param clock: Function returning the current time in seconds
+        """
+        self.store = store
+        self.up_threshold = up_threshold
+        self.down_threshold = down_threshold
+        self.hold_down = hold_down
+        self.clock = clock
+        self.state = store.load()
+
+    def _record(self, name):
+        # Firewalls start as up as the routes are set up for both firewalls when the stack is deployed
+        return self.state.setdefault(name, {'state': UP, 'successes': 0, 'failures': 0, 'changed': 0, 'version': 0})
+
+    def _reload(self):
+        """
+        Reads the latest state, as another invocation may have changed it since this one last read it
+
+        :return: Dictionary of firewall name to the version of its record
+        """
+        self.state = self.store.load()
+        return {name: record.get('version', 0) for name, record in self.state.items()}
+
+    def _save(self, names, versions, force=False):
+        """
+        Saves the records of the firewalls that this invocation changed.  The state is read again first and
+        only those records are replaced, so a record another invocation wrote in the meantime, for example a
+        mark_down from an instance state event, is kept rather than overwritten.
+
+        :param names: Names of the firewalls whose records changed
+        :param versions: Dictionary of firewall name to the version of its record when it was read
+        :param force: Replace the records even if they were written meanwhile
+        :return: Names of the firewalls whose change was dropped because the record was written meanwhile
+        """
+        latest = self.store.load()
+        conflicts = []
+        for name in names:
+            stored = latest.get(name)
+            version = stored.get('version', 0) if stored is not None else 0
+            if not force and version != versions.get(name, 0):
+                logger.info("[INFO]: Firewall {} was updated by another invocation, keeping {}".format(
+                    name, stored['state']))
+                conflicts.append(name)
+            else:
+                self.state[name]['version'] = version + 1
+                latest[name] = self.state[name]
+        self.store.save(latest)
+        self.state = latest
+        return conflicts
+
+    def update(self, fw_status):
+        """
+        Applies one round of probe results to the latest state and saves the firewalls whose state changed
+
+        :param fw_status: Dictionary of firewall name to probe status ('running' or 'down')
+        :return: List of (firewall name, new state) transitions
+        """
+        versions = self._reload()
+        now = self.clock()
+        transitions = []
+        changed = []
+        for name, status in fw_status.items():
+            record = self._record(name)
+            before = dict(record)
+            if status == 'running':
+                record['failures'] = 0
+                record['successes'] = min(record['successes'] + 1, self.up_threshold)
+                if record['state'] == DOWN and record['successes'] >= self.up_threshold \
+                        and now - record['changed'] >= self.hold_down:
+                    record['state'] = UP
+                    record['changed'] = now
+                    transitions.append((name, UP))
+            else:
+                record['successes'] = 0
+                record['failures'] = min(record['failures'] + 1, self.down_threshold)
+                if record['state'] == UP and record['failures'] >= self.down_threshold:
+                    record['state'] = DOWN
+                    record['changed'] = now
+                    transitions.append((name, DOWN))
+            if record != before:
+                changed.append(name)
+
+        if changed:
+            conflicts = self._save(changed, versions)
+            transitions = [(name, state) for name, state in transitions if name not in conflicts]
+        for name, state in transitions:
+            logger.info("[INFO]: Firewall {} is now {}".format(name, state))
+        return transitions
+
+    def mark_down(self, name):
+        """
+        Marks a firewall down straight away without waiting for failed probes, for example when the instance
+        is known to be stopping.  The hold down timer starts again.
+
+        :param name: Firewall name
+        :return: True if the firewall was up
+        """
+        versions = self._reload()
+        record = self._record(name)
+        was_up = record['state'] == UP
+        record['state'] = DOWN
+        record['successes'] = 0
+        record['failures'] = self.down_threshold
+        record['changed'] = self.clock()
+        logger.info("[INFO]: Firewall {} is now {}".format(name, DOWN))
+        # The instance is stopping, so this record replaces whatever was written meanwhile
+        self._save([name], versions, force=True)
+        return was_up
+
+    def confirmed_status(self, names):
+        """
+        :param names: Firewall names
+        :return: Dictionary of firewall name to confirmed status ('running' or 'down')
+        """
+        return {name: 'running' if self._record(name)['state'] == UP else 'down' for name in names}
@@ -0,0 +1,22 @@
+"""
+Palo Alto Networks panosapi
+
+Client for the PAN-OS XML API used by deploy.py and the Lambda functions.
+
+panosapi.pool keeps a keep-alive HTTPS connection to each firewall and panosapi.client builds the API calls,
+the chassis-ready probe and the retry and deadline policies on top of it.  panosapi.config batches configuration
+changes into one request and panosapi.readiness suggests how long to wait before probing a booting firewall again.
+
+This software is provided without support, warranty, or guarantee.
+Use at your own risk.
+"""
+
+from .pool import DEFAULT_TIMEOUT, PanApiError, api_call, close_all, get_stats, request
+from .client import ALMOST, CMD_ERROR, NO_ANSWER, READY
+from .client import CONFIG_POLICY, KEYGEN_POLICY, PROBE_POLICY
+from .client import ChassisStatus, JobStatus, PanCommandError, RetryPolicy
+from .client import call, call_async, chassis_ready, chassis_ready_async, commit, job_status, keygen, parse_response
+from .client import parse_version, software_version
+from .client import probe_many, wait_for_job
+from .config import MULTI_CONFIG_VERSION, ConfigBatch, ConfigOperation, read_node, supports_multi_config
+from .readiness import COMMITTING, MAX_WAIT, MIN_WAIT, Readiness, observe, suggest_wait
@@ -0,0 +1,405 @@
+"""
+Palo Alto Networks panosapi/client.py
+
+PAN-OS XML API calls shared by deploy.py and the Lambda functions.
+
+Every call goes through the keep-alive pool in panosapi.pool and follows a RetryPolicy, which sets the timeout of
+each attempt, the number of attempts, the backoff between attempts and an overall deadline.  The chassis-ready
+probe returns a ChassisStatus rather than a bare string so that callers do not parse the XML themselves.
+
+Calls can be made synchronously, or as asyncio futures with the *_async functions, which run the blocking call on
+a shared thread pool.  probe_many() probes several firewalls at the same time under one deadline.
+
+This software is provided without support, warranty, or guarantee.
+Use at your own risk.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+import xml.etree.ElementTree as et
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from .pool import DEFAULT_TIMEOUT, PanApiError, api_call
+
+logger = logging.getLogger()
+
+# States returned by the chassis-ready probe.  The values are the strings the scripts have always used.
+READY = 'yes'
+ALMOST = 'almost'
+NO_ANSWER = 'no'
+CMD_ERROR = 'cmd_error'
+
+# Worker threads shared by the async calls and probe_many()
+MAX_WORKERS = 32
+
+CHASSIS_READY_CMD = '<show><chassis-ready></chassis-ready></show>'
+SYSTEM_INFO_CMD = '<show><system><info></info></system></show>'
+
+
+class PanCommandError(PanApiError):
+    """Raised when the firewall answers a call with status="error" or with a response that cannot be parsed"""
+
+    def __init__(self, message, code=None):
+        """
+        :param message: Error message
+        :param code: PAN-OS response code of the error, None if the response had none
+        """
+        super(PanCommandError, self).__init__(message)
+        self.code = code
+
+
+class ChassisStatus(namedtuple('ChassisStatus', ['host', 'state', 'detail', 'elapsed'])):
+    """
+    Result of the chassis-ready probe
+
+    host: Address of the firewall
+    state: READY, ALMOST, NO_ANSWER or CMD_ERROR
+    detail: Reason for the state, for logging
+    elapsed: Seconds the probe took
+    """
+    __slots__ = ()
+
+    @property
+    def ready(self):
+        """True when the firewall is ready to accept configuration and traffic"""
+        return self.state == READY
+
+    @property
+    def responding(self):
+        """True when the management plane answered, even if the dataplane is not ready yet"""
+        return self.state in (READY, ALMOST)
+
+
+class RetryPolicy(object):
+    """
+    Timeout, retry and deadline settings for a call
+    """
+
+    def __init__(self, attempts=1, timeout=DEFAULT_TIMEOUT, backoff=1.0, max_backoff=30.0, deadline=None):
+        """
+        :param attempts: Maximum number of attempts, None to retry until the deadline
+        :param timeout: Seconds to wait for each attempt, None to wait without limit
+        :param backoff: Seconds to wait after the first failed attempt, doubled after every further failure
+        :param max_backoff: Longest wait between attempts
+        :param deadline: Seconds after which no further attempt is made, None for no deadline
+        """
+        self.attempts = attempts
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+
+
+# One quick attempt, used by health probes that are repeated anyway
+PROBE_POLICY = RetryPolicy(attempts=1, timeout=5)
+# Configuration calls ride out a short loss of the management connection
+CONFIG_POLICY = RetryPolicy(attempts=3, timeout=60, backoff=2.0)
+# Key generation waits for the management plane to come up while the firewall boots
+KEYGEN_POLICY = RetryPolicy(attempts=None, timeout=5, backoff=30.0, max_backoff=30.0, deadline=1800)
+
+
+def call(host, params, policy=CONFIG_POLICY, method='POST'):
+    """
+    Makes an XML API call following the retry policy.  Connection failures and HTTP errors are retried, a
+    response from the firewall is returned as it is.
+
+    :param host: IP address of the firewall
+    :param params: Dictionary of API parameters such as type, cmd, action, xpath and key
+    :param policy: RetryPolicy
+    :param method: 'POST' sends the parameters in the body, 'GET' in the query string
+    :return: Response body
+    """
+    start = time.time()
+    attempt = 0
+    delay = policy.backoff
+    while True:
+        attempt += 1
+        timeout = policy.timeout
+        if policy.deadline is not None:
+            remaining = policy.deadline - (time.time() - start)
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        try:
+            return api_call(host, params, timeout=timeout, method=method)
+        except PanApiError as e:
+            out_of_attempts = policy.attempts is not None and attempt >= policy.attempts
+            out_of_time = policy.deadline is not None and time.time() - start + delay >= policy.deadline
+            if out_of_attempts or out_of_time:
+                raise
+            logger.info("[INFO]: Call to {} failed with {}, retry {} in {} secs".format(host, e, attempt, delay))
+            time.sleep(delay)
+            delay = min(delay * 2, policy.max_backoff)
+
+
+def parse_response(data):
+    """
+    Parses an XML API response
+
+    :param data: Response body
+    :return: The response element
+    """
+    try:
+        response = et.fromstring(data)
+    except et.ParseError as e:
+        raise PanCommandError("Could not parse response: {}".format(e))
+    if response.tag != 'response':
+        raise PanCommandError("Did not get a valid response")
+    if response.attrib.get('status') != 'success':
+        raise PanCommandError("Command failed: {}".format(et.tostring(response).decode('utf-8')),
+                              response.attrib.get('code'))
+    return response
+
+
+def chassis_ready(host, api_key, policy=PROBE_POLICY):
+    """
+    Sends the show chassis-ready op command to find out whether the firewall is ready
+
+    :param host: IP address of the firewall
+    :param api_key: Panos API key
+    :param policy: RetryPolicy
+    :return: ChassisStatus
+    """
+    params = {
+        'type': 'op',
+        'cmd': CHASSIS_READY_CMD,
+        'key': api_key
+    }
+    start = time.time()
+    try:
+        data = call(host, params, policy=policy, method='GET')
+    except PanApiError as e:
+        return ChassisStatus(host, NO_ANSWER, str(e), time.time() - start)
+    elapsed = time.time() - start
+
+    try:
+        response = parse_response(data)
+    except PanCommandError as e:
+        return ChassisStatus(host, CMD_ERROR, str(e), elapsed)
+    result = response.find('result')
+    text = (result.text or '').strip() if result is not None else ''
+    if text == 'yes':
+        return ChassisStatus(host, READY, 'Chassis is ready', elapsed)
+    # The management plane answers but the dataplane is not ready, autocommit is still running
+    return ChassisStatus(host, ALMOST, 'Chassis is not ready', elapsed)
+
+
+def parse_version(version):
+    """
+    :param version: PAN-OS version string such as '8.1.0' or '9.0.3-h3'
+    :return: Tuple of the numeric parts, (8, 1, 0) or (9, 0, 3)
+    """
+    parts = []
+    for part in version.strip().split('-')[0].split('.'):
+        if not part.isdigit():
+            break
+        parts.append(int(part))
+    return tuple(parts)
+
+
+def software_version(host, api_key, policy=PROBE_POLICY):
+    """
+    Reads the PAN-OS version with the show system info op command
+
+    :param host: IP address of the firewall
+    :param api_key: Panos API key
+    :param policy: RetryPolicy
+    :return: Tuple of the numeric parts of the version, empty if the firewall did not report it
+    """
+    params = {
+        'type': 'op',
+        'cmd': SYSTEM_INFO_CMD,
+        'key': api_key
+    }
+    response = parse_response(call(host, params, policy=policy, method='GET'))
+    return parse_version(response.findtext('result/system/sw-version') or '')
+
+
+def keygen(host, username, password, policy=KEYGEN_POLICY):
+    """
+    Generates an API key from the username and password
+
+    :param host: IP address of the firewall
+    :param username: Firewall administrator
+    :param password: Password of the administrator
+    :param policy: RetryPolicy
+    :return: API key
+    """
+    params = {
+        'type': 'keygen',
+        'user': username,
+        'password': password
+    }
+    response = parse_response(call(host, params, policy=policy))
+    return response.find('result/key').text
+
+
+class JobStatus(namedtuple('JobStatus', ['id', 'status', 'result', 'progress', 'details'])):
+    """
+    Status of a job such as a commit
+
+    id: Job id
+    status: 'ACT' while the job runs, 'FIN' when it has finished
+    result: 'OK' or 'FAIL' once the job has finished
+    progress: Percentage complete
+    details: Messages from the firewall
+    """
+    __slots__ = ()
+
+    @property
+    def finished(self):
+        return self.status == 'FIN'
+
+    @property
+    def succeeded(self):
+        return self.finished and self.result == 'OK'
+
+
+def commit(host, api_key, message='', policy=CONFIG_POLICY):
+    """
+    Starts a commit
+
+    :param host: IP address of the firewall
+    :param api_key: Panos API key
+    :param message: Commit description
+    :param policy: RetryPolicy
+    :return: Id of the commit job, or None if there was nothing to commit
+    """
+    params = {
+        'type': 'commit',
+        'key': api_key,
+        'cmd': '<commit>{}</commit>'.format(message)
+    }
+    response = parse_response(call(host, params, policy=policy))
+    job_id = response.findtext('result/job')
+    if job_id is None:
+        logger.info("[INFO]: Nothing to commit on {}".format(host))
+        return None
+    logger.info("[INFO]: Commit job {} started on {}".format(job_id.strip(), host))
+    return job_id.strip()
+
+
+def job_status(host, api_key, job_id, policy=PROBE_POLICY):
+    """
+    :param host: IP address of the firewall
+    :param api_key: Panos API key
+    :param job_id: Job id
+    :param policy: RetryPolicy
+    :return: JobStatus
+    """
+    params = {
+        'type': 'op',
+        'cmd': '<show><jobs><id>{}</id></jobs></show>'.format(job_id),
+        'key': api_key
+    }
+    job = parse_response(call(host, params, policy=policy, method='GET')).find('result/job')
+    if job is None:
+        raise PanCommandError("Job {} not found on {}".format(job_id, host))
+    details = [line.text.strip() for line in job.iter('line') if line.text]
+    return JobStatus(job_id, job.findtext('status', ''), job.findtext('result', ''),
+                     job.findtext('progress', ''), details)
+
+
+def wait_for_job(host, api_key, job_id, deadline, interval=1.0, max_interval=15.0):
+    """
+    Polls a job until it finishes or the deadline passes.  The interval between polls doubles up to
+    max_interval as commits take minutes.  No poll is started that could end after the deadline.
+
+    :param host: IP address of the firewall
+    :param api_key: Panos API key
+    :param job_id: Job id
+    :param deadline: Seconds to wait
+    :param interval: Seconds before the second poll
+    :param max_interval: Longest interval between polls
+    :return: The last JobStatus, check finished to see if the job completed in time
+    """
+    start = time.time()
+    end = start + deadline
+    policy = RetryPolicy(attempts=1, timeout=max(min(PROBE_POLICY.timeout, deadline), 1))
+    status = job_status(host, api_key, job_id, policy=policy)
+    while not status.finished:
+        # Leave time for the poll itself to time out before the deadline
+        wait = min(interval, end - time.time() - policy.timeout)
+        if wait < 0:
+            break
+        time.sleep(wait)
+        status = job_status(host, api_key, job_id, policy=policy)
+        interval = min(interval * 2, max_interval)
+    logger.info("[INFO]: Job {} on {} is {} {} after {:.1f} secs".format(
+        job_id, host, status.status, status.result, time.time() - start))
+    return status
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+        return _executor
+
+
+def _running_loop(loop):
+    """
+    :param loop: Event loop passed by the caller or None
+    :return: The loop, or the loop running the calling coroutine
+    """
+    if loop is not None:
+        return loop
+    # get_running_loop() is new in python 3.7, in 3.6 get_event_loop() returns the running loop inside a coroutine
+    return getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)()
+
+
+def call_async(host, params, policy=CONFIG_POLICY, method='POST', loop=None):
+    """
+    Asyncio version of call()
+
+    :return: Future of the response body
+    """
+    loop = _running_loop(loop)
+    return loop.run_in_executor(_get_executor(), call, host, params, policy, method)
+
+
+def chassis_ready_async(host, api_key, policy=PROBE_POLICY, loop=None):
+    """
+    Asyncio version of chassis_ready()
+
+    :return: Future of the ChassisStatus
+    """
+    loop = _running_loop(loop)
+    return loop.run_in_executor(_get_executor(), chassis_ready, host, api_key, policy)
+
+
+def probe_many(hosts, api_key, deadline=DEFAULT_TIMEOUT, policy=None):
+    """
+    Probes every firewall at the same time and waits at most deadline seconds for the whole round.  A firewall
+    that has not answered by the deadline is reported as NO_ANSWER, so the round takes as long as the slowest
+    probe rather than the sum of all probes.
+
+    :param hosts: Dictionary of firewall name to IP address
+    :param api_key: Panos API key
+    :param deadline: Seconds to wait for all the probes
+    :param policy: RetryPolicy of each probe, by default a single attempt that times out at the deadline
+    :return: Dictionary of firewall name to ChassisStatus
+    """
+    if not hosts:
+        return {}
+    policy = policy or RetryPolicy(attempts=1, timeout=deadline)
+    futures = {_get_executor().submit(chassis_ready, host, api_key, policy): name for name, host in hosts.items()}
+    done, not_done = wait(futures, timeout=deadline)
+
+    status = {}
+    for future, name in futures.items():
+        host = hosts[name]
+        if future in not_done:
+            status[name] = ChassisStatus(host, NO_ANSWER, 'Missed the {} sec deadline'.format(deadline), deadline)
+            continue
+        try:
+            status[name] = future.result()
+        except Exception as e:
+            status[name] = ChassisStatus(host, CMD_ERROR, str(e), 0)
+    return status
@@ -0,0 +1,222 @@
+"""
+Palo Alto Networks panosapi/config.py
+
+Batched configuration changes for the PAN-OS XML API.
+
+A ConfigBatch collects any number of set, edit and delete operations for one firewall and sends them in a single
+multi-config request, so adding configuration items does not add round trips.  The firewall applies the
+operations in order and rejects the whole batch if any one of them fails.  The multi-config action only exists
+from PAN-OS 9.0, so older firewalls are sent one request per operation instead.
+
+changes() reads the running configuration at the xpaths of the batch and returns only the operations that would
+change it, so a firewall that is already configured needs neither a push nor a commit.
+
+This software is provided without support, warranty, or guarantee.
+Use at your own risk.
+"""
+
+import logging
+import xml.etree.ElementTree as et
+from collections import namedtuple
+from xml.sax.saxutils import quoteattr
+
+from .client import CONFIG_POLICY, PROBE_POLICY, PanCommandError, call, parse_response, software_version
+
+logger = logging.getLogger()
+
+SET = 'set'
+EDIT = 'edit'
+DELETE = 'delete'
+
+# First PAN-OS version with the multi-config action
+MULTI_CONFIG_VERSION = (9, 0)
+
+# Response code of a show of a node that is not in the running configuration
+NO_SUCH_NODE = '7'
+
+ConfigOperation = namedtuple('ConfigOperation', ['action', 'xpath', 'element'])
+
+# Firewall to whether it supports multi-config, kept for the life of the warm container
+_multi_config_support = {}
+
+
+def same_element(a, b):
+    """
+    Compares two elements ignoring whitespace between tags and any attribute other than name, as the firewall
+    adds attributes such as admin and time to the nodes it returns
+    """
+    if a.tag != b.tag or a.get('name') != b.get('name') or (a.text or '').strip() != (b.text or '').strip():
+        return False
+    return len(a) == len(b) and all(same_element(x, y) for x, y in zip(a, b))
+
+
+def contains_children(node, element):
+    """
+    :param node: Current element
+    :param element: Children that a set would merge into the node
+    :return: True if every child is already in the node
+    """
+    children = et.fromstring('<set>{}</set>'.format(element))
+    for child in children:
+        current = [old for old in node if old.tag == child.tag and old.get('name') == child.get('name')]
+        if not current or not same_element(current[-1], child):
+            return False
+    return True
+
+
+def read_node(host, api_key, xpath, action='show', policy=PROBE_POLICY):
+    """
+    Reads one node of the configuration
+
+    :param host: IP address of the firewall
+    :param api_key: Panos API key
+    :param xpath: xpath of the node
+    :param action: 'show' reads the running configuration, 'get' the candidate configuration
+    :param policy: RetryPolicy
+    :return: The element or None if the node does not exist
+    """
+    params = {
+        'type': 'config',
+        'action': action,
+        'key': api_key,
+        'xpath': xpath
+    }
+    try:
+        result = parse_response(call(host, params, policy=policy)).find('result')
+    except PanCommandError as e:
+        # show answers a missing node with an error rather than an empty result
+        if e.code == NO_SUCH_NODE or 'No such node' in str(e):
+            return None
+        raise
+    if result is None or len(result) == 0:
+        return None
+    return result[0]
+
+
+def supports_multi_config(host, api_key, policy=PROBE_POLICY):
+    """
+    :param host: IP address of the firewall
+    :param api_key: Panos API key
+    :param policy: RetryPolicy of the version check
+    :return: True if the PAN-OS version of the firewall has the multi-config action
+    """
+    if host not in _multi_config_support:
+        version = software_version(host, api_key, policy=policy)
+        logger.info("Firewall {} runs PAN-OS {}".format(host, '.'.join(str(part) for part in version)))
+        _multi_config_support[host] = version >= MULTI_CONFIG_VERSION
+    return _multi_config_support[host]
+
+
+class ConfigBatch(object):
+    """
+    Configuration operations for one firewall that are sent together
+    """
+
+    def __init__(self):
+        self.operations = []
+
+    def __len__(self):
+        return len(self.operations)
+
+    def set(self, xpath, element):
+        """
+        Adds or merges the element at the xpath
+        :param xpath: xpath of the parent of the element
+        :param element: Child elements to set
+        """
+        self.operations.append(ConfigOperation(SET, xpath, element))
+        return self
+
+    def edit(self, xpath, element):
+        """
+        Replaces the node at the xpath
+        :param xpath: xpath of the node
+        :param element: The new node, including its own tag
+        """
+        self.operations.append(ConfigOperation(EDIT, xpath, element))
+        return self
+
+    def delete(self, xpath):
+        """
+        Deletes the node at the xpath
+        :param xpath: xpath of the node
+        """
+        self.operations.append(ConfigOperation(DELETE, xpath, ''))
+        return self
+
+    def element(self):
+        """
+        :return: The multi-config element with one child per operation, numbered in order
+        """
+        children = ''.join('<{0} id="{1}" xpath={2}>{3}</{0}>'.format(op.action, number, quoteattr(op.xpath),
+                                                                      op.element)
+                           for number, op in enumerate(self.operations, 1))
+        return '<multi-config>{}</multi-config>'.format(children)
+
+    def changes(self, host, api_key, policy=PROBE_POLICY):
+        """
+        Compares the operations with the running configuration of the firewall
+
+        :param host: IP address of the firewall
+        :param api_key: Panos API key
+        :param policy: RetryPolicy of the reads
+        :return: ConfigBatch of the operations that would change the running configuration
+        """
+        changes = ConfigBatch()
+        for op in self.operations:
+            node = read_node(host, api_key, op.xpath, policy=policy)
+            if op.action == SET:
+                unchanged = node is not None and contains_children(node, op.element)
+            elif op.action == EDIT:
+                unchanged = node is not None and same_element(node, et.fromstring(op.element))
+            else:
+                unchanged = node is None
+            if not unchanged:
+                changes.operations.append(op)
+        logger.info("{} of {} config operations change the running config of {}".format(
+            len(changes), len(self), host))
+        return changes
+
+    def push(self, host, api_key, policy=CONFIG_POLICY, multi_config=None):
+        """
+        Sends every operation in one multi-config request, or one request per operation to a firewall older than
+        PAN-OS 9.0.  Nothing is sent for an empty batch.
+
+        :param host: IP address of the firewall
+        :param api_key: Panos API key
+        :param policy: RetryPolicy
+        :param multi_config: Whether to use multi-config, found from the PAN-OS version of the firewall if not set
+        :return: The response element of the last request or None for an empty batch
+        """
+        if not self.operations:
+            return None
+        if multi_config is None:
+            multi_config = supports_multi_config(host, api_key)
+        if not multi_config:
+            return self._push_each(host, api_key, policy)
+        logger.info("Sending {} config operations to {} in one request".format(len(self.operations), host))
+        params = {
+            'type': 'config',
+            'action': 'multi-config',
+            'key': api_key,
+            'element': self.element()
+        }
+        return parse_response(call(host, params, policy=policy))
+
+    def _push_each(self, host, api_key, policy):
+        """
+        Sends the operations in order, one request each
+        """
+        logger.info("Sending {} config operations to {} one at a time".format(len(self.operations), host))
+        response = None
+        for op in self.operations:
+            params = {
+                'type': 'config',
+                'action': op.action,
+                'key': api_key,
+                'xpath': op.xpath
+            }
+            if op.action != DELETE:
+                params['element'] = op.element
+            response = parse_response(call(host, params, policy=policy))
+        return response
@@ -0,0 +1,189 @@
+"""
+Palo Alto Networks panosapi/pool.py
+
+Keep-alive HTTPS connection pool for the PAN-OS XML API.
+
+The pool holds one connection per firewall at module level so that it survives across warm Lambda
+invocations.  Requests to a firewall reuse the open connection, and when a new connection is needed
+the TLS session of the previous connection is offered so that the handshake can be resumed.
+Counters for reused and new connections are available from get_stats().
+
+This software is provided without support, warranty, or guarantee.
+Use at your own risk.
+"""
+
+import http.client
+import logging
+import socket
+import ssl
+import threading
+import urllib.parse
+
+logger = logging.getLogger()
+
+DEFAULT_TIMEOUT = 5
+
+
+class PanApiError(IOError):
+    """Raised when the firewall cannot be reached or returns an HTTP error"""
+    pass
+
+
+def _create_context():
+    """
+    Create the SSL context shared by every pooled connection.  Firewalls use self signed certificates
+    so certificate checking is turned off.
+    """
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    # No certificate check
+    ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+_context = _create_context()
+_pool = {}
+_pool_lock = threading.Lock()
+_stats = {
+    'requests': 0,
+    'new_connections': 0,
+    'reused_connections': 0,
+    'tls_sessions_resumed': 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _count(counter):
+    with _stats_lock:
+        _stats[counter] += 1
+
+
+def get_stats():
+    """
+    Returns a copy of the pool counters
+    :return: Dictionary with requests, new_connections, reused_connections and tls_sessions_resumed
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+class _KeepAliveHTTPSConnection(http.client.HTTPSConnection):
+    """
+    HTTPSConnection that offers the TLS session from a previous connection to the same firewall
+    """
+
+    def __init__(self, host, timeout, context, tls_session=None):
+        super().__init__(host, timeout=timeout, context=context)
+        self.tls_session = tls_session
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=self.host, session=self.tls_session)
+        if self.sock.session_reused:
+            _count('tls_sessions_resumed')
+
+
+class _PoolEntry(object):
+    """
+    The pooled connection for one firewall.  The lock serialises requests to the firewall because a
+    keep-alive connection can only carry one request at a time.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.lock = threading.Lock()
+        self.conn = None
+        self.tls_session = None
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def _get_entry(host):
+    with _pool_lock:
+        entry = _pool.get(host)
+        if entry is None:
+            entry = _PoolEntry(host)
+            _pool[host] = entry
+        return entry
+
+
+def close_all():
+    """
+    Closes every pooled connection
+    """
+    with _pool_lock:
+        entries = list(_pool.values())
+    for entry in entries:
+        with entry.lock:
+            entry.close()
+
+
+def request(host, method, path, body=None, headers=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Sends a request to the firewall over the pooled connection.  A request that fails on a reused
+    connection is retried once on a new connection as the firewall may have closed the idle connection.
+
+    :param host: IP address of the firewall
+    :param method: HTTP method
+    :param path: Request path including the query string
+    :param body: Request body
+    :param headers: Dictionary of request headers
+    :param timeout: Seconds to wait for the firewall to answer
+    :return: Tuple of HTTP status and response body
+    """
+    entry = _get_entry(host)
+    _count('requests')
+    with entry.lock:
+        while True:
+            if entry.conn is not None and entry.conn.sock is None:
+                entry.close()
+            fresh = entry.conn is None
+            if fresh:
+                entry.conn = _KeepAliveHTTPSConnection(host, timeout, _context, entry.tls_session)
+                _count('new_connections')
+            else:
+                entry.conn.timeout = timeout
+                entry.conn.sock.settimeout(timeout)
+                _count('reused_connections')
+            try:
+                entry.conn.request(method, path, body=body, headers=headers or {})
+                response = entry.conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                entry.close()
+                if fresh or isinstance(e, socket.timeout):
+                    raise PanApiError("Request to {} failed: {}".format(host, e))
+                logger.debug("Pooled connection to {} was closed, reconnecting".format(host))
+                continue
+
+            if entry.conn.sock is not None:
+                # Session tickets may only arrive after the first response so save the session now
+                entry.tls_session = entry.conn.sock.session
+            if response.will_close:
+                entry.close()
+            return response.status, data
+
+
+def api_call(host, params, timeout=DEFAULT_TIMEOUT, method='POST'):
+    """
+    Makes a call to the XML API of the firewall
+
+    :param host: IP address of the firewall
+    :param params: Dictionary of API parameters such as type, cmd, action, xpath and key
+    :param timeout: Seconds to wait for the firewall to answer
+    :param method: 'POST' sends the parameters in the body, 'GET' in the query string
+    :return: Response body
+    """
+    encoded = urllib.parse.urlencode(params)
+    if method == 'GET':
+        status, data = request(host, 'GET', '/api/?' + encoded, timeout=timeout)
+    else:
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        status, data = request(host, 'POST', '/api/', body=encoded.encode('utf-8'), headers=headers,
+                               timeout=timeout)
+    if status >= 400:
+        raise PanApiError("HTTP error {} from {}".format(status, host))
+    return data
@@ -0,0 +1,79 @@
+"""
+Palo Alto Networks panosapi/readiness.py
+
+Suggested wait before the next readiness probe of a booting firewall.
+
+A VM-Series firewall gives no answer for several minutes while it boots, then the management plane answers while
+the dataplane starts (chassis-ready 'no', the 'almost' state) and finally it is ready.  Probing often during the
+long silent phase is wasted effort, while probing rarely once the management plane answers delays the
+configuration.  suggest_wait() therefore waits long early in the silent phase, shortens the wait as the firewall
+approaches its usual boot time, and waits briefly in the 'almost' phase.
+
+This software is provided without support, warranty, or guarantee.
+Use at your own risk.
+"""
+
+import time
+from collections import namedtuple
+
+from .client import ALMOST, CMD_ERROR, NO_ANSWER, READY
+
+# State of a firewall whose configuration is being committed
+COMMITTING = 'committing'
+
+# Usual seconds from the first probe until the management plane answers
+EXPECTED_SILENT_SECS = 420
+MIN_WAIT = 10
+MAX_WAIT = 180
+
+# Fixed waits for the states that do not depend on the time in the state
+STATE_WAITS = {
+    ALMOST: 15,
+    CMD_ERROR: 30,
+    COMMITTING: 20,
+    READY: MIN_WAIT,
+}
+
+
+class Readiness(namedtuple('Readiness', ['state', 'since', 'wait'])):
+    """
+    Readiness of one firewall
+
+    state: Probe state of the firewall (READY, ALMOST, NO_ANSWER, CMD_ERROR) or COMMITTING
+    since: Time the firewall entered the state, in seconds since the epoch
+    wait: Suggested seconds before the next probe
+    """
+    __slots__ = ()
+
+    def as_dict(self):
+        return dict(self._asdict())
+
+
+def suggest_wait(state, seconds_in_state):
+    """
+    :param state: Probe state of the firewall or COMMITTING
+    :param seconds_in_state: Seconds since the firewall entered the state
+    :return: Suggested seconds before the next probe
+    """
+    if state == NO_ANSWER:
+        # Half the time left to the usual boot time, so probes get closer together as the firewall nears it
+        wait = (EXPECTED_SILENT_SECS - seconds_in_state) / 2.0
+    else:
+        wait = STATE_WAITS.get(state, MAX_WAIT / 3)
+    return int(min(max(wait, MIN_WAIT), MAX_WAIT))
+
+
+def observe(previous, state, now=None):
+    """
+    Records a probe result
+
+    :param previous: Readiness from the previous probe, a dictionary as returned by as_dict() or None
+    :param state: State seen by this probe
+    :param now: Time of the probe, the current time if not set
+    :return: Readiness
+    """
+    now = time.time() if now is None else now
+    if isinstance(previous, dict):
+        previous = Readiness(**previous)
+    since = previous.since if previous is not None and previous.state == state else now
+    return Readiness(state, since, suggest_wait(state, now - since))
@@ -0,0 +1,150 @@
+"""
+Palo Alto Networks routeplanner.py
+
+Works out the route changes needed for the current firewall health.
+
+The planner does not make any API calls.  Given the firewall health, the routing policy and a RouteTableView
+snapshot it computes the desired next hop for every prefix that is routed to a firewall and returns only the
+routes whose next hop has to change.  The route monitor then applies that list with apply_next_hops().
+
+Any number of firewalls is supported.  Prefixes without a preferred firewall in the policy are spread across the
+healthy firewalls by rendezvous (highest random weight) hashing, so when a firewall fails only its share of the
+prefixes moves and the share is spread over the remaining firewalls.
+
+Preempt only moves the prefixes that the policy places: the preferred prefixes of the firewall pair and, for a
+pool, the spoke prefixes.  Any other route stays on the firewall it points to for as long as that firewall is
+healthy.
+
+This software is provided without support, warranty, or guarantee.
+Use at your own risk.
+"""
+
+import hashlib
+from collections import namedtuple
+
+DEFAULT_ROUTE = '0.0.0.0/0'
+
+RouteChange = namedtuple('RouteChange', ['cidr', 'current_eni', 'desired_eni'])
+
+
+def is_enabled(value):
+    """
+    Environment variables and template parameters use both yes/no and true/false
+    :param value: String or bool
+    :return: True for 'yes' or 'true'
+    """
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('yes', 'true')
+
+
+def build_policy(vpc_summary_route, split_routes, preempt, def_route=DEFAULT_ROUTE):
+    """
+    Builds the routing policy for the firewall pair.  The default route prefers firewall 1.  With split routes the
+    VPC summary route prefers firewall 2 for east/west traffic, otherwise it also prefers firewall 1.
+
+    :param vpc_summary_route: Summary route for the spoke VPCs
+    :param split_routes: Use both firewalls, one for internet and one for east/west traffic
+    :param preempt: Move prefixes back to their preferred firewall when it is healthy again
+    :param def_route: The default route
+    :return: Policy dictionary
+    """
+    split_routes = is_enabled(split_routes)
+    return {
+        'preferred': {
+            def_route: 'fw1',
+            vpc_summary_route: 'fw2' if split_routes else 'fw1',
+        },
+        # Failback only restores the split between the firewalls, as without split routes both prefixes
+        # prefer the same firewall
+        'preempt': is_enabled(preempt) and split_routes,
+        'prefixes': [],
+        'pool': False,
+    }
+
+
+def build_pool_policy(spoke_prefixes, preempt):
+    """
+    Builds the routing policy for a pool of firewalls where every prefix is spread across the firewalls by hashing
+
+    :param spoke_prefixes: Prefixes that must be routed through the pool even if they are not in the route table yet
+    :param preempt: Move prefixes back to the firewall they hash to when it is healthy again
+    :return: Policy dictionary
+    """
+    return {
+        'preferred': {},
+        'preempt': is_enabled(preempt),
+        'prefixes': list(spoke_prefixes),
+        'pool': True,
+    }
+
+
+def hash_firewall(cidr, firewalls):
+    """
+    Chooses a firewall for a prefix by rendezvous hashing.  Removing a firewall only remaps the prefixes that
+    hashed to it.
+
+    :param cidr: Destination CIDR block
+    :param firewalls: Firewall names to choose from
+    :return: Firewall name
+    """
+    return max(firewalls, key=lambda name: hashlib.md5('{}|{}'.format(name, cidr).encode('utf-8')).digest())
+
+
+def is_placed(cidr, policy):
+    """
+    :param cidr: Destination CIDR block
+    :param policy: Policy dictionary
+    :return: True if the policy decides which firewall the prefix uses, so preempt may move it
+    """
+    return cidr in policy['preferred'] or (policy['pool'] and cidr in policy['prefixes'])
+
+
+def desired_firewall(current, preferred, healthy, preempt):
+    """
+    Chooses the firewall for one prefix
+
+    :param current: Firewall the prefix is routed to now or None if it is not routed to a firewall
+    :param preferred: Firewall the policy prefers for the prefix, it must be healthy
+    :param healthy: List of healthy firewalls
+    :param preempt: Move the prefix back to its preferred firewall when that firewall is healthy
+    :return: Firewall name
+    """
+    if current in healthy and not preempt:
+        return current
+    return preferred
+
+
+def plan_route_changes(route_view, fw_status, firewall_enis, policy):
+    """
+    Computes the minimal list of route changes.  The routes that point to one of the firewalls and the prefixes of
+    the policy that are missing from the route table are managed.  When no firewall is healthy nothing is changed.
+
+    :param route_view: RouteTableView snapshot of the route table
+    :param fw_status: Dictionary of firewall name to confirmed status ('running' or 'down')
+    :param firewall_enis: Dictionary of firewall name to trust eni
+    :param policy: Policy dictionary from build_policy() or build_pool_policy()
+    :return: List of RouteChange sorted by destination CIDR
+    """
+    healthy = sorted(name for name, status in fw_status.items() if status == 'running' and name in firewall_enis)
+    if not healthy:
+        return []
+
+    current = {}
+    for name, eni in firewall_enis.items():
+        for cidr in route_view.cidrs_via(eni):
+            current[cidr] = name
+    for cidr in policy['prefixes']:
+        # Prefixes routed to something other than a firewall are left alone
+        if cidr not in current and cidr not in route_view.by_cidr:
+            current[cidr] = None
+
+    changes = []
+    for cidr, name in current.items():
+        preferred = policy['preferred'].get(cidr)
+        if preferred not in healthy:
+            preferred = hash_firewall(cidr, healthy)
+        desired = desired_firewall(name, preferred, healthy, policy['preempt'] and is_placed(cidr, policy))
+        if desired != name:
+            changes.append(RouteChange(cidr, firewall_enis.get(name), firewall_enis[desired]))
+    return sorted(changes, key=lambda change: change.cidr)
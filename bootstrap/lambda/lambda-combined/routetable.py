@@ -0,0 +1,167 @@
+"""
+Palo Alto Networks routetable.py
+
+Indexed snapshot of a VPC route table used by the route monitor.
+
+The route table is read once per invocation with describe_route_tables and indexed by destination CIDR
+and by next hop eni so that the failover decisions are dictionary lookups rather than repeated scans
+of the route list.
+
+Route changes are made in place with replace_route so that there is no gap without a route, and all the
+routes that need to change are replaced concurrently with retries when the EC2 API throttles the calls.
+
+This software is provided without support, warranty, or guarantee.
+Use at your own risk.
+"""
+
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# Error codes returned by the EC2 API when calls are being throttled
+THROTTLE_ERROR_CODES = ('RequestLimitExceeded', 'Throttling', 'ThrottlingException')
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 0.2
+MAX_MUTATION_WORKERS = 10
+
+
+class RouteTableView(object):
+    """
+    Snapshot of the routes in a single route table indexed by destination CIDR and next hop eni
+    """
+
+    def __init__(self, route_table_id, routes):
+        """
+        :param route_table_id: The route table the routes were read from
+        :param routes: List of routes as returned by describe_route_tables
+        """
+        self.route_table_id = route_table_id
+        self.by_cidr = {}
+        self.by_eni = {}
+        for route in routes:
+            # IPv6 and prefix list routes have no DestinationCidrBlock and are never modified
+            cidr = route.get('DestinationCidrBlock')
+            if cidr is None:
+                continue
+            self.by_cidr[cidr] = route
+            eni = route.get('NetworkInterfaceId')
+            if eni:
+                self.by_eni.setdefault(eni, set()).add(cidr)
+
+    @classmethod
+    def snapshot_many(cls, ec2_client, route_table_ids):
+        """
+        Reads several route tables with a single describe_route_tables call
+
+        :param ec2_client: boto3 ec2 client
+        :param route_table_ids: The route tables to read
+        :return: Dictionary of route table id to RouteTableView
+        """
+        response = ec2_client.describe_route_tables(RouteTableIds=list(route_table_ids))
+        return {route_table['RouteTableId']: cls(route_table['RouteTableId'], route_table['Routes'])
+                for route_table in response['RouteTables']}
+
+    def next_hop(self, cidr):
+        """
+        :param cidr: Destination CIDR block
+        :return: The next hop eni of the route or None if the route does not exist or uses another target
+        """
+        route = self.by_cidr.get(cidr)
+        if route is None:
+            return None
+        return route.get('NetworkInterfaceId')
+
+    def cidrs_via(self, eni):
+        """
+        :param eni: NetworkInterfaceId
+        :return: Sorted list of destination CIDR blocks whose next hop is the eni
+        """
+        return sorted(self.by_eni.get(eni, ()))
+
+    def record_next_hop(self, cidr, eni):
+        """
+        Updates the snapshot after a route has been changed so that later decisions in the same invocation
+        see the new next hop without reading the route table again.
+
+        :param cidr: Destination CIDR block
+        :param eni: The new next hop eni
+        """
+        old_eni = self.next_hop(cidr)
+        if old_eni:
+            self.by_eni[old_eni].discard(cidr)
+        self.by_cidr[cidr] = {'DestinationCidrBlock': cidr, 'NetworkInterfaceId': eni, 'State': 'active'}
+        self.by_eni.setdefault(eni, set()).add(cidr)
+
+
+def replace_route(ec2_client, route_table_id, destination_cidr_block, eni, dry_run=False):
+    """
+    Points an existing route at a new eni with a single replace_route call.  If the route does not exist it
+    is created.  Throttled calls are retried with exponential backoff and jitter.
+
+    :param ec2_client: boto3 ec2 client
+    :param route_table_id: The route table that requires modification
+    :param destination_cidr_block: The cidr block that we need to change
+    :param eni: The new next hop eni
+    :param dry_run: Perform a DryRun - Doesn't update the route table
+    :return: Response to replace_route or create_route
+    """
+    kwargs = {
+        'DryRun': dry_run,
+        'DestinationCidrBlock': destination_cidr_block,
+        'RouteTableId': route_table_id,
+        'NetworkInterfaceId': eni
+    }
+    call = ec2_client.replace_route
+    attempt = 0
+    while True:
+        try:
+            return call(**kwargs)
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if code == 'InvalidRoute.NotFound' and call == ec2_client.replace_route:
+                logger.info("Route {} not found in {}, creating it".format(destination_cidr_block, route_table_id))
+                call = ec2_client.create_route
+                continue
+            if code not in THROTTLE_ERROR_CODES or attempt >= MAX_RETRIES:
+                raise
+            delay = random.uniform(0, RETRY_BASE_DELAY * (2 ** attempt))
+            attempt += 1
+            logger.info("Throttled replacing route {}, retry {} in {:.2f} secs".format(destination_cidr_block,
+                                                                                      attempt, delay))
+            time.sleep(delay)
+
+
+def apply_next_hops(ec2_client, route_view, next_hops, dry_run=False):
+    """
+    Replaces every route in next_hops concurrently so that the time taken is that of the slowest single call
+    rather than the sum of all calls.  The route table snapshot is updated for every route that was changed.
+
+    :param ec2_client: boto3 ec2 client
+    :param route_view: RouteTableView snapshot of the route table that requires modification
+    :param next_hops: Dictionary of destination CIDR block to the new next hop eni
+    :param dry_run: Perform a DryRun - Doesn't update the route table
+    :return: Dictionary of destination CIDR block to the API response or None if the change failed
+    """
+    results = {}
+    if not next_hops:
+        return results
+
+    with ThreadPoolExecutor(max_workers=min(len(next_hops), MAX_MUTATION_WORKERS)) as executor:
+        futures = {executor.submit(replace_route, ec2_client, route_view.route_table_id, cidr, eni, dry_run): cidr
+                   for cidr, eni in next_hops.items()}
+        for future, cidr in futures.items():
+            try:
+                results[cidr] = future.result()
+            except ClientError as e:
+                logger.info("Got error {} replacing route {}. Moving on.".format(e, cidr))
+                results[cidr] = None
+                continue
+            logger.info("Success replacing {} route next hop {}".format(cidr, next_hops[cidr]))
+            if not dry_run:
+                route_view.record_next_hop(cidr, next_hops[cidr])
+    return results
@@ -0,0 +1,63 @@
+"""
+Palo Alto Networks subnetcache.py
+
+Batched and cached subnet lookups.
+
+Subnets do not change for the life of a deployment, so every subnet that has been described is kept in the warm
+container keyed by subnet id.  Subnets that are not cached yet are fetched together in one describe_subnets call,
+and later invocations, such as step function retries, make no EC2 calls for them at all.
+
+This software is provided without support, warranty, or guarantee.
+Use at your own risk.
+"""
+
+import logging
+import threading
+
+from awsclients import get_client
+
+logger = logging.getLogger()
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def describe_subnets(subnet_ids, ec2_client=None):
+    """
+    Returns the subnets, fetching the ones that are not cached with a single describe_subnets call
+
+    :param subnet_ids: List of subnet ids
+    :param ec2_client: boto3 ec2 client, the shared client is used if not set
+    :return: Dictionary of subnet id to subnet as returned by describe_subnets
+    """
+    with _lock:
+        missing = sorted(set(subnet_id for subnet_id in subnet_ids if subnet_id not in _cache))
+    if missing:
+        ec2_client = ec2_client or get_client('ec2')
+        logger.info("Describing subnets {}".format(missing))
+        response = ec2_client.describe_subnets(SubnetIds=missing)
+        with _lock:
+            for subnet in response['Subnets']:
+                _cache[subnet['SubnetId']] = subnet
+    else:
+        logger.info("Subnets {} found in cache".format(sorted(set(subnet_ids))))
+
+    with _lock:
+        return {subnet_id: _cache[subnet_id] for subnet_id in subnet_ids if subnet_id in _cache}
+
+
+def get_subnet(subnet_id, ec2_client=None):
+    """
+    :param subnet_id: Subnet id
+    :param ec2_client: boto3 ec2 client, the shared client is used if not set
+    :return: The subnet as returned by describe_subnets or None if it was not found
+    """
+    return describe_subnets([subnet_id], ec2_client).get(subnet_id)
+
+
+def clear():
+    """
+    Empties the cache
+    """
+    with _lock:
+        _cache.clear()
@@ -1,19 +1,27 @@
 import argparse
+import hashlib
 import json
 import logging
 import os
 import time
 import uuid
-import xml.etree.ElementTree as ET
-import urllib3
 import sys
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 from urllib.request import urlopen
 
 
 import boto3
-import requests
-from botocore.exceptions import ClientError
-urllib3.disable_warnings()
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+# The PAN-OS API client is shared with the Lambda functions
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bootstrap', 'lambda', 'lambda-combined'))
+import panosapi  # noqa: E402
+from stackmonitor import StackMonitor  # noqa: E402
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -29,146 +37,167 @@ DEPLOYMENTDATA = 'deployment_data.json'
 PARAMSFILE = './parameters.json'
 TEMPLATEFILE = 'template.json'
 
-
-def send_request(call):
+# Seconds a firewall probe waits for an answer.  The wait between probes is the one panosapi.suggest_wait gives
+# for the boot phase, long while the firewall does not answer and short once the dataplane starts, but at most
+# FW_MAX_POLL_INTERVAL so that the status line does not stall.
+FW_PROBE_TIMEOUT = 10
+FW_MAX_POLL_INTERVAL = 60
+FW_STATE_NAMES = {
+    panosapi.READY: 'ready',
+    panosapi.ALMOST: 'dataplane starting',
+    panosapi.NO_ANSWER: 'booting',
+    panosapi.CMD_ERROR: 'mgmt starting',
+}
+FW_WAIT_TIMEOUT = 1800
+
+# Logical ids of the EIP, EIP association and instance of each firewall in the template
+FIREWALL_RESOURCES = {
+    'fw1': ('EIP1', 'associateEIP1', 'FW1Instance'),
+    'fw2': ('EIP2', 'associateEIP2', 'FW2Instance'),
+}
+
+# The Lambda functions are deployed from LAMBDA_ZIP, which is built from LAMBDA_SOURCE_DIR before every upload
+LAMBDA_SOURCE_DIR = os.path.join('bootstrap', 'lambda', 'lambda-combined')
+LAMBDA_ZIP = os.path.join('bootstrap', 'lambda', 'lambda-combined.zip')
+
+# Files and folders that are never uploaded.  Importing panosapi from the Lambda folder writes __pycache__ there.
+UPLOAD_SKIP = ('__pycache__', '.DS_Store')
+
+# Files uploaded at the same time
+UPLOAD_WORKERS = 8
+# Files larger than this are uploaded in parts of MULTIPART_CHUNKSIZE, MULTIPART_CONCURRENCY parts at a time
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+MULTIPART_CONCURRENCY = 4
+
+
+def status_line(readiness, started):
     """
-    Handles sending requests to API
-    :param call: url
-    :return: Retruns result of call. Will return response for codes between 200 and 400.
-             If 200 response code is required check value in response
+    :param readiness: Dictionary of firewall name to panosapi.Readiness
+    :param started: Time the wait started
+    :return: One line with the state of every firewall and the time waited
     """
-    headers = {'Accept-Encoding': 'None',
-               'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
-
-    try:
-        r = requests.get(call, headers=headers, verify=False, timeout=5)
-        r.raise_for_status()
-    except requests.exceptions.HTTPError as errh:
-        '''
-        Firewall may return 5xx error when rebooting.  Need to handle a 5xx response 
-        '''
-        logger.debug("DeployRequestException Http Error:")
-        raise FWNotUpException("Http Error:")
-    except requests.exceptions.ConnectionError as errc:
-        logger.debug("DeployRequestException Connection Error:")
-        raise FWNotUpException("Connection Error")
-    except requests.exceptions.Timeout as errt:
-        logger.debug("DeployRequestException Timeout Error:")
-        raise FWNotUpException("Timeout Error")
-    except requests.exceptions.RequestException as err:
-        logger.debug("DeployRequestException RequestException Error:")
-        raise FWNotUpException("Request Error")
-    else:
-        return r
-
-
-def check_firewall(fwMgtIP, api_key):
-    print('{:^80}'.format('****** Checking firewall at ' + fwMgtIP + ' ******' ))
-    while True:
-        err = getFirewallStatus(fwMgtIP, api_key)
-        if err == 'cmd_error':
-            logger.info("Command error from fw ")
-
-        elif err == 'no':
-            # logger.info("FW is not up...yet")
-            print('{:^80}'.format('****** FW is not up yet checking in 60 secs ******'))
-            time.sleep(60)
-            continue
-
-        elif err == 'almost':
-            print('{:^80}'.format('MGT up waiting for dataplane'))
-            time.sleep(20)
-            continue
-
-        elif err == 'yes':
-            print('{:^80}'.format('****** FW is up ******'))
-            break
-    return 'yes'
+    now = time.time()
+    states = ' | '.join('{}: {} {:.0f}s'.format(name, FW_STATE_NAMES.get(r.state, r.state), now - r.since)
+                        for name, r in sorted(readiness.items()))
+    return '{} | waited {:.0f}s'.format(states, now - started)
 
 
-def getFirewallStatus(fwIP, api_key):
-    fwip = fwIP
-
+def wait_for_firewalls(fw_ips, api_key, timeout=FW_WAIT_TIMEOUT, live=True):
     """
-    Gets the firewall status by sending the API request show chassis status.
-    :param fwMgtIP:  IP Address of firewall interface to be probed
-    :param api_key:  Panos API key
+    Waits for all the firewalls at the same time.  Every round probes the firewalls that are not ready yet in
+    parallel, and the wait before the next round depends on the boot phase of those firewalls, so the wait ends
+    as soon as the slowest firewall is ready.
+
+    :param fw_ips: Dictionary of firewall name to management IP address
+    :param api_key: Panos API key
+    :param timeout: Seconds to wait for the firewalls
+    :param live: Rewrite one status line in place, otherwise print a line whenever a firewall changes state
+    :return: Dictionary of firewall name to the last state, 'yes' for the firewalls that are ready
     """
-    global gcontext
-
-    url = "https://%s/api/?type=op&cmd=<show><chassis-ready></chassis-ready></show>&key=%s" % (fwip, api_key)
-    # Send command to fw and see if it times out or we get a response
-    logger.info("Sending command 'show chassis status' to firewall")
-    try:
-        response = requests.get(url, verify=False, timeout=10)
-        response.raise_for_status()
-    except requests.exceptions.Timeout as fwdownerr:
-        logger.debug("No response from FW. So maybe not up!")
-        return 'no'
-        # sleep and check again?
-    except requests.exceptions.HTTPError as fwstartgerr:
-        '''
-        Firewall may return 5xx error when rebooting.  Need to handle a 5xx response
-        raise_for_status() throws HTTPError for error responses
-        '''
-        logger.infor("Http Error: {}: ".format(fwstartgerr))
-        return 'cmd_error'
-    except requests.exceptions.RequestException as err:
-        logger.debug("Got RequestException response from FW. So maybe not up!")
-        return 'cmd_error'
-    else:
-        logger.debug("Got response to 'show chassis status' {}".format(response))
+    started = time.time()
+    readiness = {}
+    while True:
+        pending = {name: ip for name, ip in fw_ips.items()
+                   if name not in readiness or readiness[name].state != panosapi.READY}
+        status = panosapi.probe_many(pending, api_key, deadline=FW_PROBE_TIMEOUT)
+        changed = False
+        for name, fw_status in status.items():
+            previous = readiness.get(name)
+            readiness[name] = panosapi.observe(previous, fw_status.state)
+            changed = changed or previous is None or previous.state != fw_status.state
+            logger.debug('Firewall {} {} {}'.format(name, fw_status.state, fw_status.detail))
+        if changed and not live:
+            print('{:%H:%M:%S} {}'.format(datetime.now(), status_line(readiness, started)))
+
+        if all(r.state == panosapi.READY for r in readiness.values()) or time.time() - started >= timeout:
+            break
 
-        resp_header = ET.fromstring(response.content)
-        logger.debug('Response header is {}'.format(resp_header))
+        # Poll as often as the firewall that is closest to ready needs
+        wait = min(r.wait for r in readiness.values() if r.state != panosapi.READY)
+        next_round = time.time() + min(wait, FW_MAX_POLL_INTERVAL)
+        while time.time() < next_round:
+            if live:
+                sys.stdout.write('\r' + status_line(readiness, started).ljust(78))
+                sys.stdout.flush()
+            time.sleep(min(1, max(next_round - time.time(), 0)))
 
-        if resp_header.tag != 'response':
-            logger.debug("Did not get a valid 'response' string...maybe a timeout")
-            return 'cmd_error'
+    if live:
+        sys.stdout.write('\r' + status_line(readiness, started).ljust(78) + '\n')
+    return {name: r.state for name, r in readiness.items()}
 
-        if resp_header.attrib['status'] == 'error':
-            logger.debug("Got an error for the command")
-            return 'cmd_error'
 
-        if resp_header.attrib['status'] == 'success':
-            # The fw responded with a successful command execution. So is it ready?
-            for element in resp_header:
-                if element.text.rstrip() == 'yes':
-                    logger.info("FW Chassis is ready to accept configuration and connections")
-                    return 'yes'
-                else:
-                    logger.info("FW Chassis not ready, still waiting for dataplane")
-                    time.sleep(10)
-                    return 'almost'
+class FirewallWatcher(object):
+    """
+    Starts waiting for the firewalls while the rest of the stack is still being created.
 
+    The public IP of a firewall is the physical id of its EIP, so it is known from the stack events without any
+    extra call.  Once the EIPs are associated and the instances exist, wait_for_firewalls runs in the background
+    and the firewalls boot while the stack creates the remaining resources.
+    """
 
-class FWNotUpException(Exception):
-    pass
+    def __init__(self, api_key, resources=None):
+        """
+        :param api_key: Panos API key
+        :param resources: Dictionary of firewall name to the logical ids of its EIP, EIP association and instance
+        """
+        self.api_key = api_key
+        self.resources = resources or FIREWALL_RESOURCES
+        self.created = set()
+        self.fw_ips = {}
+        self.thread = None
+        self.result = None
+
+    def on_event(self, event):
+        """
+        Stack event handler, passed to monitor_stack
+        """
+        if event['ResourceStatus'] != 'CREATE_COMPLETE':
+            return
+        self.created.add(event['LogicalResourceId'])
+        for name, (eip, association, instance) in self.resources.items():
+            if event['LogicalResourceId'] == eip:
+                self.fw_ips[name] = event['PhysicalResourceId']
+        if self.thread is None and all(set(ids) <= self.created for ids in self.resources.values()):
+            self.start()
+
+    def start(self):
+        print('Firewalls {} created, probing them while the stack finishes'.format(self.fw_ips))
+        self.thread = threading.Thread(target=self._wait, name='FirewallWatcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _wait(self):
+        try:
+            self.result = wait_for_firewalls(self.fw_ips, self.api_key, live=False)
+        except Exception as e:
+            logger.info('Got exception waiting for firewalls {}'.format(e))
+
+    def wait(self, fw_ips):
+        """
+        Waits for the background probing to finish, or waits for the firewalls now if it was never started, did
+        not finish or probed other addresses than the stack outputs.  A background thread probing other addresses
+        is abandoned rather than joined, it is a daemon thread and ends with the script.
+
+        :param fw_ips: Dictionary of firewall name to IP address from the stack outputs
+        :return: Dictionary of firewall name to the last state
+        """
+        if self.thread is not None and self.fw_ips == fw_ips:
+            self.thread.join()
+            if self.result is not None:
+                return self.result
+        elif self.thread is not None:
+            logger.info('Firewall addresses changed from {} to {}, probing again'.format(self.fw_ips, fw_ips))
+        return wait_for_firewalls(fw_ips, self.api_key, live=sys.stdout.isatty())
 
 
 def getApiKey(hostname, username, password):
     """
-    Generate the API key from username / password
+    Generate the API key from username / password.  Keeps retrying while the management plane boots.
     """
-
-    call = "https://%s/api/?type=keygen&user=%s&password=%s" % (hostname, username, password)
-    api_key = ""
-    while True:
-        try:
-            # response = urllib.request.urlopen(url, data=encoded_data, context=ctx).read()
-            response = send_request(call)
-
-        except FWNotUpException as updateerr:
-            logger.info("No response from FW. Wait 30 secs before retry")
-            time.sleep(30)
-            # raise FWNotUpException("Timeout Error")
-            continue
-
-        else:
-            api_key = ET.XML(response.content)[0][0].text
-            logger.info("FW Management plane is Responding so checking if Dataplane is ready")
-            logger.debug("Response to get_api is {}".format(response))
-            return api_key
+    api_key = panosapi.keygen(hostname, username, password)
+    logger.info("FW Management plane is Responding so checking if Dataplane is ready")
+    return api_key
 
 
 def generate_random_string():
@@ -268,6 +297,135 @@ def get_template(template_file):
     return cf_template
 
 
+def build_lambda_zip(source_dir=LAMBDA_SOURCE_DIR, zip_path=LAMBDA_ZIP):
+    """
+
+    Packages the Lambda sources so that the functions run the code in the repository.  Entries are sorted and
+    have fixed timestamps and permissions, so the same sources always give the same zip and an unchanged zip is
+    not uploaded again.
+    :param source_dir: Folder with the Lambda sources
+    :param zip_path: Zip file to write
+    :return: Number of files in the zip
+    """
+    files = []
+    for subdir, dirs, names in os.walk(source_dir):
+        dirs[:] = [name for name in dirs if name not in UPLOAD_SKIP]
+        files.extend(os.path.join(subdir, name) for name in names
+                     if name not in UPLOAD_SKIP and not name.endswith('.pyc'))
+
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for full_path in sorted(files):
+            info = zipfile.ZipInfo(os.path.relpath(full_path, source_dir).replace(os.sep, '/'),
+                                   date_time=(1980, 1, 1, 0, 0, 0))
+            info.external_attr = 0o644 << 16
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with open(full_path, 'rb') as data:
+                archive.writestr(info, data.read())
+    logger.info('Built {} with {} files'.format(zip_path, len(files)))
+    return len(files)
+
+
+def list_upload_files(working_dir):
+    """
+
+    Lists the files to upload and the S3 key of each one.  Files in the 'lambda' folder are placed into the root
+    of the bucket.  Python caches and Finder metadata in UPLOAD_SKIP are left out
+    :param working_dir:
+    :return: List of (local path, S3 key) tuples
+    """
+    uploads = []
+    for subdir, dirs, files in os.walk(working_dir):
+        dirs[:] = [name for name in dirs if name not in UPLOAD_SKIP]
+        for file in files:
+            if file in UPLOAD_SKIP:
+                continue
+            key = subdir.replace(working_dir + '/', '')
+            full_path = os.path.join(subdir, file)
+            filename_path = os.path.join(key, file)
+            if 'lambda' in filename_path:
+                filename_path = filename_path.replace('lambda/', '')
+            uploads.append((full_path, filename_path))
+    return uploads
+
+
+def upload_file(s3_client, s3bucket_name, full_path, key, transfer_config):
+    """
+
+    Uploads one file.  Files larger than the multipart threshold of the transfer config are sent in parts
+    :param s3_client:
+    :param s3bucket_name:
+    :param full_path: Local path of the file
+    :param key: S3 key
+    :param transfer_config: boto3.s3.transfer.TransferConfig
+    :return: Tuple of key, size in bytes and seconds taken
+    """
+    start = time.time()
+    s3_client.upload_file(full_path, s3bucket_name, key, ExtraArgs={'ACL': 'public-read'}, Config=transfer_config)
+    return key, os.path.getsize(full_path), time.time() - start
+
+
+def s3_etag(full_path, transfer_config):
+    """
+
+    Computes the ETag S3 gives the file when it is uploaded with the transfer config: the MD5 of the content for a
+    single part upload and the MD5 of the part MD5s followed by the number of parts for a multipart upload
+    :param full_path: Local path of the file
+    :param transfer_config: boto3.s3.transfer.TransferConfig
+    :return: ETag without quotes
+    """
+    size = os.path.getsize(full_path)
+    with open(full_path, 'rb') as data:
+        if size < transfer_config.multipart_threshold:
+            return hashlib.md5(data.read()).hexdigest()
+        digests = [hashlib.md5(part).digest() for part in iter(lambda: data.read(transfer_config.multipart_chunksize),
+                                                               b'')]
+    return '{}-{}'.format(hashlib.md5(b''.join(digests)).hexdigest(), len(digests))
+
+
+def build_manifest(uploads, transfer_config):
+    """
+
+    Content hash manifest of the files to upload
+    :param uploads: List of (local path, S3 key) tuples
+    :param transfer_config: boto3.s3.transfer.TransferConfig
+    :return: Dictionary of S3 key to a dictionary with the local path, size and expected ETag
+    """
+    return {key: {'path': full_path, 'size': os.path.getsize(full_path), 'etag': s3_etag(full_path, transfer_config)}
+            for full_path, key in uploads}
+
+
+def stored_etags(s3_client, s3bucket_name):
+    """
+
+    Lists the objects already in the bucket
+    :param s3_client:
+    :param s3bucket_name:
+    :return: Dictionary of S3 key to ETag without quotes, empty if the bucket cannot be listed
+    """
+    etags = {}
+    try:
+        for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=s3bucket_name):
+            for obj in page.get('Contents', []):
+                etags[obj['Key']] = obj['ETag'].strip('"')
+    except ClientError as e:
+        logger.info('Unable to list bucket {} {}'.format(s3bucket_name, e))
+    return etags
+
+
+def bucket_exists(s3_client, s3bucket_name):
+    """
+
+    :param s3_client:
+    :param s3bucket_name:
+    :return: True if the bucket exists and can be used with these credentials
+    """
+    try:
+        s3_client.head_bucket(Bucket=s3bucket_name)
+        return True
+    except ClientError:
+        return False
+
+
 def upload_files(s3bucket_name, working_dir, aws_region):
     """
 
@@ -276,28 +434,49 @@ def upload_files(s3bucket_name, working_dir, aws_region):
     by placing a 0 bytes file in each folder.  S3 does not implement a true folder structure so a zero bytes file is
     required to create the folder structure.
     file in the 'lambda folder are placed into the root of the bucket
+
+    Only files whose content differs from the object already in the bucket are uploaded, so a persistent bucket
+    that is reused across deployments needs no transfer when nothing changed.  The local files are compared using
+    the ETag S3 would give them.  Files are uploaded UPLOAD_WORKERS at a time over one client and files larger than
+    MULTIPART_THRESHOLD are sent in parts.  The time taken by each file and the overall throughput are reported.
     :param s3bucket_name:
     :param working_dir:
     :param aws_region:
-    :return:
+    :return: List of (key, size in bytes, seconds taken) tuples of the uploaded files
     """
+    # One connection per upload thread and per part of a multipart upload
     s3_client = boto3.client("s3",
                              region_name=aws_region,
                              aws_access_key_id=ACCESS_KEY,
-                             aws_secret_access_key=SECRET_KEY)
-
-    for subdir, dirs, files in os.walk(working_dir):
-        for file in files:
-            key = subdir.replace(working_dir + '/', '')
-            full_path = os.path.join(subdir, file)
-            filename_path = os.path.join(key, file)
-            if 'lambda' in filename_path:
-                filename_path = filename_path.replace('lambda/', '')
-
-            with open(full_path, 'rb')as data:
-                response = s3_client.put_object(
-                    ACL='public-read', Body=data, Bucket=s3bucket_name, Key=filename_path)
-            logger.info('Response {}'.format(response))
+                             aws_secret_access_key=SECRET_KEY,
+                             config=Config(max_pool_connections=UPLOAD_WORKERS * MULTIPART_CONCURRENCY))
+    transfer_config = TransferConfig(multipart_threshold=MULTIPART_THRESHOLD,
+                                     multipart_chunksize=MULTIPART_CHUNKSIZE,
+                                     max_concurrency=MULTIPART_CONCURRENCY)
+
+    manifest = build_manifest(list_upload_files(working_dir), transfer_config)
+    etags = stored_etags(s3_client, s3bucket_name)
+    uploads = [(entry['path'], key) for key, entry in manifest.items() if etags.get(key) != entry['etag']]
+    print('{} of {} files in {} are unchanged in {}'.format(len(manifest) - len(uploads), len(manifest),
+                                                            working_dir, s3bucket_name))
+    # Largest files first so that they do not finish last on their own
+    uploads.sort(key=lambda upload: manifest[upload[1]]['size'], reverse=True)
+
+    results = []
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        futures = [executor.submit(upload_file, s3_client, s3bucket_name, full_path, key, transfer_config)
+                   for full_path, key in uploads]
+        for future in as_completed(futures):
+            key, size, elapsed = future.result()
+            print('Uploaded {} ({} bytes) in {:.2f} secs'.format(key, size, elapsed))
+            results.append((key, size, elapsed))
+    elapsed = time.time() - start
+
+    total = sum(size for key, size, file_elapsed in results)
+    print('Uploaded {} files ({:.1f} KiB) to {} in {:.2f} secs, {:.1f} KiB/s'.format(
+        len(results), total / 1024.0, s3bucket_name, elapsed, total / 1024.0 / max(elapsed, 0.001)))
+    return results
 
 
 def validate_cf_template(cf_template, sc):
@@ -329,47 +508,35 @@ def validate_cf_template(cf_template, sc):
         return False
 
 
-def monitor_stack(stack_name, aws_region):
+def monitor_stack(stack_name, aws_region, on_event=None):
     """
 
-    Monitors the status of the deployment by running describe_stacks every 30 secs to report progress to the user
+    Monitors the deployment by following the stack events and reports the progress of each resource to the user
     :param stack_name:
-    :return:
+    :param on_event: Function called with each stack event
+    :return: The final stack status or None if the stack was not found
     """
     cf_client = boto3.client('cloudformation',
                              region_name=aws_region,
                              aws_access_key_id=ACCESS_KEY,
                              aws_secret_access_key=SECRET_KEY)
 
-    while True:
-        try:
-            stack_data = cf_client.describe_stacks(StackName=stack_name)
-            if stack_data['Stacks'][0]['StackStatus'] == 'ROLLBACK_IN_PROGRESS':
-                print('{:^80}'.format('Stack is rolling back - check the event logs'))
-                time.sleep(30)
-                continue
-            elif stack_data['Stacks'][0]['StackStatus'] == 'DELETE_IN_PROGRESS':
-                print('{:^80}'.format('Stack still deleting'))
-                time.sleep(30)
-                continue
-            elif stack_data['Stacks'][0]['StackStatus'] == 'CREATE_IN_PROGRESS':
-                print('{:^80}'.format('Stack still creating - check again in 30 secs'))
-                time.sleep(30)
-                continue
-            elif stack_data['Stacks'][0]['StackStatus'] == 'CREATE_COMPLETE':
-                print('{:^80}'.format('****** Stack has deployed successfully ******\n'))
-                break
-            elif stack_data['Stacks'][0]['StackStatus'] == 'ROLLBACK_FAILED':
-                print('{:^80}'.format('Stack has failed to rollback check your console'))
-                break
-        except ClientError as error:
-            logger.info('Got exception {}'.format(error))
-            break
-        except Exception as e:
-            logger.info('Got exception {}'.format(e))
-            break
-
-    return
+    try:
+        stack_data = cf_client.describe_stacks(StackName=stack_name)
+        monitor = StackMonitor(cf_client, stack_data['Stacks'][0]['StackId'], on_event=on_event)
+        status = monitor.wait()
+    except (ClientError, BotoCoreError) as error:
+        logger.info('Got exception {}'.format(error))
+        return None
+
+    monitor.report()
+    if status == 'CREATE_COMPLETE':
+        print('{:^80}'.format('****** Stack has deployed successfully ******\n'))
+    elif status == 'ROLLBACK_COMPLETE':
+        print('{:^80}'.format('Stack has rolled back - check the event logs'))
+    else:
+        print('{:^80}'.format('Stack finished with status {} check your console'.format(status)))
+    return status
 
 
 def main():
@@ -398,6 +565,8 @@ def main():
     parser.add_argument('-k', '--aws_access_key', help='AWS Key', required=True)
     parser.add_argument('-s', '--aws_secret_key', help='AWS Secret', required=True)
     parser.add_argument('-c', '--aws_key_pair', help='AWS EC2 Key Pair', required=True)
+    parser.add_argument('-b', '--s3_bucket', help='Existing or new S3 bucket for the bootstrap files that is kept '
+                                                  'and reused by later deployments')
 
     args = parser.parse_args()
     ACCESS_KEY = args.aws_access_key
@@ -416,8 +585,10 @@ def main():
                              aws_secret_access_key=SECRET_KEY)
 
     params_list = []
+    api_key = None
     prefix = generate_random_string()
-    s3bucket_name = aws_region + '-' + prefix + '-tgw-direct'
+    s3bucket_name = args.s3_bucket or aws_region + '-' + prefix + '-tgw-direct'
+    persistent_bucket = bool(args.s3_bucket)
     #
     # In us-east-1 url does not have s3-{aws_region}.amazonaws.com but simply s3.amazonaws.com
     #
@@ -457,22 +628,27 @@ def main():
             for k, v in params_dict.items():
                 temp_dict = {'ParameterKey': k, "ParameterValue": v}
                 params_list.append(temp_dict)
+            api_key = params_dict.get('apikey', None)
     except Exception as e:
         print('Got exception {}'.format(e))
 
     try:
-        if  aws_region == 'us-east-1':
-            s3_client.create_bucket(
-                Bucket=s3bucket_name
-            )
+        if persistent_bucket and bucket_exists(s3_client, s3bucket_name):
+            print('Reusing S3 Bucket {}'.format(s3bucket_name))
         else:
-            s3_client.create_bucket(Bucket=s3bucket_name,
-                                    CreateBucketConfiguration={'LocationConstraint': aws_region})
+            if aws_region == 'us-east-1':
+                s3_client.create_bucket(
+                    Bucket=s3bucket_name
+                )
+            else:
+                s3_client.create_bucket(Bucket=s3bucket_name,
+                                        CreateBucketConfiguration={'LocationConstraint': aws_region})
 
-        print('Created S3 Bucket {}'.format(s3bucket_name))
+            print('Created S3 Bucket {}'.format(s3bucket_name))
     except Exception as e:
         print('Got exception trying to create S3 bucket {}'.format(e))
 
+    build_lambda_zip()
     for dir in dirs:
         upload_files(s3bucket_name, dir, aws_region)
 
@@ -481,7 +657,10 @@ def main():
     else:
         print('Deploying template')
         load_template(template_url, params_list, stack_name)
-    monitor_stack(stack_name, aws_region)
+    # The firewalls are probed as soon as their EIPs and instances exist, so they boot while the stack finishes
+    watcher = FirewallWatcher(api_key) if api_key else None
+    if monitor_stack(stack_name, aws_region, watcher.on_event if watcher else None) != 'CREATE_COMPLETE':
+        sys.exit("Stack {} was not created".format(stack_name))
     try:
         r = cf_client.describe_stacks(StackName=stack_name)
     except Exception as e:
@@ -505,37 +684,23 @@ def main():
 
     config_dict.update({
         's3bucket_name': s3bucket_name,
+        'persistent_bucket': persistent_bucket,
         'stack_name': stack_name,
         'aws_region': aws_region
     })
 
     with open(DEPLOYMENTDATA, 'w+') as datafile:
         datafile.write(json.dumps(config_dict))
-    fw1_status = ''
-    fw2_status = ''
 
     print('{:^80}'.format('****** Waiting for firewalls to bootstrap ********\n'))
-    try:
-        with open(PARAMSFILE, 'r') as data:
-            params_dict = json.load(data)
-            api_key = params_dict.get('apikey', None)
-            if api_key:
-                # Check firewall 1
-                fw1_status = check_firewall(fw_pub_ips['Fw1PublicIP'], api_key)
-                fw2_status = check_firewall(fw_pub_ips['Fw2PublicIP'], api_key)
-                if fw1_status == 'yes' and fw2_status == 'yes':
-                    print('{:^80}'.format('****** Firewalls are ready ********'))
-                elif fw1_status == 'almost' or fw2_status == 'almost':
-                    print('Dataplane initialising -- waiting another 30 secs')
-                    time.sleep(30)
-                else:
-                    print('There was a problem -- fw1 status {} fw2 status {}'.format(fw1_status, fw2_status))
-
-            else:
-                print('Value for apikey not found')
-
-    except Exception as e:
-        print('Got error reading file {}'.format(PARAMSFILE))
+    if watcher:
+        fw_status = watcher.wait({'fw1': fw_pub_ips['Fw1PublicIP'], 'fw2': fw_pub_ips['Fw2PublicIP']})
+        if all(state == panosapi.READY for state in fw_status.values()):
+            print('{:^80}'.format('****** Firewalls are ready ********'))
+        else:
+            print('There was a problem -- fw1 status {} fw2 status {}'.format(fw_status['fw1'], fw_status['fw2']))
+    else:
+        print('Value for apikey not found')
 
 
 if __name__ == '__main__':
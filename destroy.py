@@ -2,11 +2,12 @@ import argparse
 import json
 import logging
 import sys
-import time
 
 import boto3
 from botocore.exceptions import ClientError
 
+from stackmonitor import StackMonitor
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 Region = ''
@@ -15,7 +16,7 @@ Region = ''
 def delete_stack(stack_name, Region, ACCESS_KEY, SECRET_KEY):
     """
 
-    Sends a delete stack request and monitors the progress of the deletion process by calling describe_stacks
+    Sends a delete stack request and monitors the progress of the deletion process by following the stack events
 
     :param stack_name:
     :param Region:
@@ -32,41 +33,33 @@ def delete_stack(stack_name, Region, ACCESS_KEY, SECRET_KEY):
     try:
         stack_data = cf_client.describe_stacks(StackName=stack_name)
         stack_id = stack_data['Stacks'][0]['StackId']
+        # Created before the delete request so that only the events of the deletion are followed
+        monitor = StackMonitor(cf_client, stack_id, skip_existing=True)
         response = cf_client.delete_stack(StackName=stack_id)
 
         if 'ResponseMetadata' in response and response['ResponseMetadata']['HTTPStatusCode'] < 300:
             logger.info("Got response: {0}".format(response))
 
-            while True:
-                try:
-                    stack_data = cf_client.describe_stacks(StackName=stack_id)
-
-                    if stack_data['Stacks'][0]['StackStatus'] == 'ROLLBACK_IN_PROGRESS':
-                        print('Stack is rolling back - check the event logs')
-                        time.sleep(30)
-                        continue
-                    elif stack_data['Stacks'][0]['StackStatus'] == 'DELETE_IN_PROGRESS':
-                        print('Stack still deleting')
-                        time.sleep(30)
-                        continue
-                    elif stack_data['Stacks'][0]['StackStatus'] == 'DELETE_FAILED':
-                        print('Stack has failed to delete check your console')
-                        return False
-                    elif stack_data['Stacks'][0]['StackStatus'] == 'ROLLBACK_FAILED':
-                        print('Stack has failed to rollback check your console')
-                        return False
-                    elif stack_data['Stacks'][0]['StackStatus'] == 'DELETE_COMPLETE':
-                        print('Stack has been deleted')
-                        return True
-                    else:
-                        print('Please check the stack deletion status in your AWS console')
-                        return False
-                except ClientError:
-                    print('Unable to find stack {}'.format(stack_name))
-                    return False
-                except Exception as e:
-                    logger.info('Got exception {}'.format(e))
-                    return False
+            try:
+                status = monitor.wait()
+            except ClientError:
+                print('Unable to find stack {}'.format(stack_name))
+                return False
+            except Exception as e:
+                logger.info('Got exception {}'.format(e))
+                return False
+
+            monitor.report()
+            if status == 'DELETE_COMPLETE':
+                print('Stack has been deleted')
+                return True
+            elif status == 'DELETE_FAILED':
+                print('Stack has failed to delete check your console')
+            elif status == 'ROLLBACK_FAILED':
+                print('Stack has failed to rollback check your console')
+            else:
+                print('Please check the stack deletion status in your AWS console')
+            return False
 
         else:
             logger.info("There was an Unexpected error. response: {0}".format(response))
@@ -129,6 +122,8 @@ def main():
             aws_region = config_dict['aws_region']
             stack_name = config_dict['stack_name']
             s3bucket_name = config_dict['s3bucket_name']
+            # A bucket passed to deploy.py with --s3_bucket is reused by later deployments and is kept
+            persistent_bucket = config_dict.get('persistent_bucket', False)
     except FileNotFoundError:
         print('File no longer exists')
     except Exception as e:
@@ -139,9 +134,12 @@ def main():
 
     if delete_stack(stack_name, aws_region, ACCESS_KEY, SECRET_KEY):
         print('Deleted Stack {}'.format(stack_name))
-        print('Deleting S3 Bucket {}'.format(s3bucket_name))
-        if delete_bucket(s3bucket_name, aws_region, ACCESS_KEY, SECRET_KEY):
-            print('Deleted S3 Bucket {}'.format(s3bucket_name))
+        if persistent_bucket:
+            print('Keeping S3 Bucket {}'.format(s3bucket_name))
+        else:
+            print('Deleting S3 Bucket {}'.format(s3bucket_name))
+            if delete_bucket(s3bucket_name, aws_region, ACCESS_KEY, SECRET_KEY):
+                print('Deleted S3 Bucket {}'.format(s3bucket_name))
     else:
         print('There was a problem deteting the stack {}'.format(stack_name))
 
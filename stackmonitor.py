@@ -0,0 +1,207 @@
+"""
+Palo Alto Networks stackmonitor.py
+
+Follows the progress of a CloudFormation stack using its event stream.
+
+StackMonitor reads describe_stack_events newest first and stops at the last event it has already seen, so each
+poll returns only the new events, usually in one page.  The poll interval starts short, is reset whenever new
+events arrive and grows while nothing happens.  The stack's own events tell when it reaches a terminal status, so
+no describe_stacks calls are needed, and the time each resource took to create or delete is recorded.
+
+This software is provided without support, warranty, or guarantee.
+Use at your own risk.
+"""
+
+import logging
+import time
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+STACK_RESOURCE_TYPE = 'AWS::CloudFormation::Stack'
+MIN_INTERVAL = 2
+MAX_INTERVAL = 30
+BACKOFF = 1.5
+
+
+def is_terminal(status):
+    """
+    :param status: Stack status
+    :return: True if the stack stays in this status until another operation is started
+    """
+    return status.endswith('_COMPLETE') or status.endswith('_FAILED')
+
+
+def is_in_progress(status):
+    return status.endswith('_IN_PROGRESS')
+
+
+class ResourceProgress(object):
+    """
+    Progress of one resource of the stack
+    """
+
+    def __init__(self, logical_id, resource_type):
+        self.logical_id = logical_id
+        self.resource_type = resource_type
+        self.status = None
+        self.reason = None
+        self.started = None
+        self.finished = None
+
+    @property
+    def duration(self):
+        """Seconds from the first in progress event to the terminal event, None until both are seen"""
+        if self.started is None or self.finished is None:
+            return None
+        return (self.finished - self.started).total_seconds()
+
+    def update(self, event):
+        self.status = event['ResourceStatus']
+        self.reason = event.get('ResourceStatusReason')
+        if is_in_progress(self.status):
+            if self.started is None or self.finished is not None:
+                self.started = event['Timestamp']
+                self.finished = None
+        elif self.finished is None:
+            self.finished = event['Timestamp']
+
+
+class StackMonitor(object):
+    """
+    Follows the events of one stack until it reaches a terminal status
+    """
+
+    def __init__(self, cf_client, stack_id, skip_existing=False, min_interval=MIN_INTERVAL,
+                 max_interval=MAX_INTERVAL, out=print, on_event=None):
+        """
+        :param cf_client: boto3 cloudformation client
+        :param stack_id: StackId of the stack.  A stack name is not found once the stack is deleted
+        :param skip_existing: Ignore the events that are already in the stream, for a stack that is being deleted
+        or updated
+        :param min_interval: Seconds between polls while events arrive
+        :param max_interval: Longest seconds between polls
+        :param out: Function called with each progress line
+        :param on_event: Function called with each new event after it is recorded, so that a caller can act on a
+        resource as soon as it exists
+        """
+        self.cf_client = cf_client
+        self.stack_id = stack_id
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.out = out
+        self.on_event = on_event
+        self.last_event_id = None
+        self.status = None
+        self.reason = None
+        self.resources = OrderedDict()
+        self.polls = 0
+        if skip_existing:
+            events = self.cf_client.describe_stack_events(StackName=stack_id)['StackEvents']
+            if events:
+                self.last_event_id = events[0]['EventId']
+
+    def new_events(self):
+        """
+        :return: Events since the last poll, oldest first
+        """
+        events = []
+        kwargs = {'StackName': self.stack_id}
+        while True:
+            response = self.cf_client.describe_stack_events(**kwargs)
+            for event in response['StackEvents']:
+                if event['EventId'] == self.last_event_id:
+                    break
+                events.append(event)
+            else:
+                if response.get('NextToken'):
+                    kwargs['NextToken'] = response['NextToken']
+                    continue
+            break
+        self.polls += 1
+        if events:
+            self.last_event_id = events[0]['EventId']
+        events.reverse()
+        return events
+
+    def handle(self, event):
+        """
+        Records one event and reports it
+        """
+        if event['ResourceType'] == STACK_RESOURCE_TYPE and event.get('PhysicalResourceId') == self.stack_id:
+            self.status = event['ResourceStatus']
+            self.reason = event.get('ResourceStatusReason')
+            self.out('{:%H:%M:%S} Stack {}'.format(event['Timestamp'], self.status))
+            return
+
+        resource = self.resources.get(event['LogicalResourceId'])
+        if resource is None:
+            resource = ResourceProgress(event['LogicalResourceId'], event['ResourceType'])
+            self.resources[resource.logical_id] = resource
+        resource.update(event)
+
+        line = '{:%H:%M:%S} {:<45} {:<20}'.format(event['Timestamp'], resource.logical_id, resource.status)
+        if resource.duration is not None:
+            line += ' {:>6.0f} secs'.format(resource.duration)
+        if resource.reason and resource.status.endswith('_FAILED'):
+            line += ' {}'.format(resource.reason)
+        done = sum(1 for r in self.resources.values() if not is_in_progress(r.status))
+        self.out('{} [{}/{}]'.format(line, done, len(self.resources)))
+
+    def poll(self):
+        """
+        Reads and reports the new events
+
+        :return: Number of new events
+        """
+        events = self.new_events()
+        for event in events:
+            self.handle(event)
+            if self.on_event is not None:
+                self.on_event(event)
+        return len(events)
+
+    def wait(self, timeout=None):
+        """
+        Polls until the stack reaches a terminal status
+
+        :param timeout: Seconds to wait, no limit if not set
+        :return: The terminal stack status, or the current status if the timeout passed first
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        interval = self.min_interval
+        while True:
+            try:
+                if self.poll():
+                    interval = self.min_interval
+                else:
+                    interval = min(interval * BACKOFF, self.max_interval)
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') != 'Throttling':
+                    raise
+                logger.info('Throttled reading stack events {}'.format(e))
+                interval = self.max_interval
+            if self.status is not None and is_terminal(self.status):
+                return self.status
+            if deadline is not None and time.time() + interval > deadline:
+                return self.status
+            time.sleep(interval)
+
+    def durations(self):
+        """
+        :return: List of (logical id, resource type, status, seconds) of the finished resources, slowest first
+        """
+        finished = [(r.logical_id, r.resource_type, r.status, r.duration) for r in self.resources.values()
+                    if r.duration is not None]
+        return sorted(finished, key=lambda resource: resource[3], reverse=True)
+
+    def report(self, top=10):
+        """
+        Reports the resources that took longest
+        :param top: Number of resources reported
+        """
+        self.out('Slowest resources ({} polls of the event stream)'.format(self.polls))
+        for logical_id, resource_type, status, seconds in self.durations()[:top]:
+            self.out('  {:<45} {:<40} {:<20} {:>6.0f} secs'.format(logical_id, resource_type, status, seconds))
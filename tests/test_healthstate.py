@@ -0,0 +1,151 @@
+"""
+Tests of the firewall health state machine of the route monitor.
+
+Usage: python -m pytest tests  or  python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bootstrap', 'lambda',
+                                'lambda-combined'))
+
+from healthstate import DOWN, UP, HealthTracker, LocalFileStateStore, MemoryStateStore  # noqa: E402
+
+RUNNING = {'fw1': 'running'}
+FAILED = {'fw1': 'down'}
+
+
+class Clock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class CountingStore(MemoryStateStore):
+    def __init__(self):
+        super(CountingStore, self).__init__()
+        self.saves = 0
+
+    def save(self, state):
+        self.saves += 1
+        super(CountingStore, self).save(state)
+
+
+class HealthTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.store = CountingStore()
+        self.tracker = self.make_tracker()
+
+    def make_tracker(self):
+        return HealthTracker(self.store, up_threshold=3, down_threshold=2, hold_down=180, clock=self.clock)
+
+    def probe(self, status, rounds=1, seconds=10):
+        transitions = []
+        for _ in range(rounds):
+            self.clock.now += seconds
+            transitions += self.tracker.update(status)
+        return transitions
+
+    def test_firewall_starts_up(self):
+        self.assertEqual(self.tracker.confirmed_status(['fw1']), RUNNING)
+
+    def test_down_after_down_threshold_failures(self):
+        self.assertEqual(self.probe(FAILED), [])
+        self.assertEqual(self.tracker.confirmed_status(['fw1']), RUNNING)
+        self.assertEqual(self.probe(FAILED), [('fw1', DOWN)])
+        self.assertEqual(self.tracker.confirmed_status(['fw1']), FAILED)
+
+    def test_good_probe_resets_failures(self):
+        self.probe(FAILED)
+        self.probe(RUNNING)
+        self.assertEqual(self.probe(FAILED), [])
+        self.assertEqual(self.tracker.confirmed_status(['fw1']), RUNNING)
+
+    def test_up_after_up_threshold_once_hold_down_passed(self):
+        self.probe(FAILED, rounds=2)
+        self.assertEqual(self.probe(RUNNING, rounds=2, seconds=100), [])
+        self.assertEqual(self.probe(RUNNING, seconds=100), [('fw1', UP)])
+        self.assertEqual(self.tracker.confirmed_status(['fw1']), RUNNING)
+
+    def test_hold_down_keeps_firewall_down(self):
+        self.probe(FAILED, rounds=2)
+        # Enough good probes but only 50 secs since the firewall went down
+        self.assertEqual(self.probe(RUNNING, rounds=5), [])
+        self.assertEqual(self.tracker.confirmed_status(['fw1']), FAILED)
+        self.clock.now += 130
+        self.assertEqual(self.probe(RUNNING, seconds=0), [('fw1', UP)])
+
+    def test_mark_down_restarts_hold_down(self):
+        self.assertTrue(self.tracker.mark_down('fw1'))
+        self.assertFalse(self.tracker.mark_down('fw1'))
+        self.assertEqual(self.tracker.confirmed_status(['fw1']), FAILED)
+        self.assertEqual(self.probe(RUNNING, rounds=3, seconds=50), [])
+        self.assertEqual(self.probe(RUNNING, seconds=50), [('fw1', UP)])
+
+    def test_unchanged_state_is_not_saved(self):
+        self.probe(RUNNING, rounds=3)
+        saves = self.store.saves
+        self.probe(RUNNING, rounds=3)
+        self.assertEqual(self.store.saves, saves)
+
+    def test_state_is_shared_through_the_store(self):
+        self.probe(FAILED, rounds=2)
+        self.assertEqual(self.make_tracker().confirmed_status(['fw1']), FAILED)
+
+    def test_polling_does_not_overwrite_concurrent_mark_down(self):
+        self.probe(RUNNING)
+        # An instance state event handled by another invocation while this one keeps polling
+        self.make_tracker().mark_down('fw1')
+        self.assertEqual(self.probe(RUNNING), [])
+        self.assertEqual(self.make_tracker().confirmed_status(['fw1']), FAILED)
+
+    def test_record_written_between_load_and_save_is_kept(self):
+        other = self.make_tracker()
+        load = self.store.load
+        loads = []
+
+        def load_and_interleave():
+            loads.append(1)
+            if len(loads) == 2:
+                # The other invocation writes after this one read the state and before it saves
+                self.store.load = load
+                other.mark_down('fw1')
+            return load()
+
+        self.store.load = load_and_interleave
+        self.assertEqual(self.probe(FAILED, rounds=1), [])
+        self.store.load = load
+        self.assertEqual(self.make_tracker().confirmed_status(['fw1']), FAILED)
+        self.assertEqual(self.store.load()['fw1']['failures'], 2)
+
+
+class LocalFileStateStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'health-state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_missing_file_is_empty_state(self):
+        self.assertEqual(LocalFileStateStore(self.path).load(), {})
+
+    def test_state_survives_a_new_tracker(self):
+        clock = Clock()
+        tracker = HealthTracker(LocalFileStateStore(self.path), clock=clock)
+        tracker.mark_down('fw2')
+        tracker = HealthTracker(LocalFileStateStore(self.path), clock=clock)
+        self.assertEqual(tracker.confirmed_status(['fw1', 'fw2']), {'fw1': 'running', 'fw2': 'down'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+"""
+Tests of the route planner of the route monitor.
+
+Usage: python -m pytest tests  or  python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bootstrap', 'lambda',
+                                'lambda-combined'))
+
+from routeplanner import (DEFAULT_ROUTE, RouteChange, build_policy, build_pool_policy, hash_firewall,  # noqa: E402
+                          plan_route_changes)
+from routetable import RouteTableView  # noqa: E402
+
+SUMMARY_ROUTE = '10.0.0.0/8'
+PAIR_ENIS = {'fw1': 'eni-1', 'fw2': 'eni-2'}
+POOL_ENIS = {'fw1': 'eni-1', 'fw2': 'eni-2', 'fw3': 'eni-3'}
+BOTH_UP = {'fw1': 'running', 'fw2': 'running'}
+
+
+def route_table(routes):
+    """
+    :param routes: Dictionary of destination CIDR to next hop eni, or to a transit gateway id
+    :return: RouteTableView
+    """
+    entries = []
+    for cidr, target in sorted(routes.items()):
+        key = 'TransitGatewayId' if target.startswith('tgw-') else 'NetworkInterfaceId'
+        entries.append({'DestinationCidrBlock': cidr, key: target})
+    return RouteTableView('rtb-test', entries)
+
+
+class PairPlannerTest(unittest.TestCase):
+
+    def test_failover_when_a_firewall_is_down(self):
+        view = route_table({DEFAULT_ROUTE: 'eni-1', SUMMARY_ROUTE: 'eni-2'})
+        policy = build_policy(SUMMARY_ROUTE, 'yes', 'no')
+        changes = plan_route_changes(view, {'fw1': 'down', 'fw2': 'running'}, PAIR_ENIS, policy)
+        self.assertEqual(changes, [RouteChange(DEFAULT_ROUTE, 'eni-1', 'eni-2')])
+
+    def test_no_changes_when_healthy_routes_are_in_place(self):
+        view = route_table({DEFAULT_ROUTE: 'eni-1', SUMMARY_ROUTE: 'eni-2'})
+        policy = build_policy(SUMMARY_ROUTE, 'yes', 'yes')
+        self.assertEqual(plan_route_changes(view, BOTH_UP, PAIR_ENIS, policy), [])
+
+    def test_preempt_with_split_routes_restores_the_split(self):
+        # The summary route was failed over to fw1 and fw2 is healthy again
+        view = route_table({DEFAULT_ROUTE: 'eni-1', SUMMARY_ROUTE: 'eni-1'})
+        policy = build_policy(SUMMARY_ROUTE, 'yes', 'yes')
+        changes = plan_route_changes(view, BOTH_UP, PAIR_ENIS, policy)
+        self.assertEqual(changes, [RouteChange(SUMMARY_ROUTE, 'eni-1', 'eni-2')])
+
+    def test_no_preempt_without_split_routes(self):
+        view = route_table({DEFAULT_ROUTE: 'eni-2', SUMMARY_ROUTE: 'eni-2'})
+        policy = build_policy(SUMMARY_ROUTE, 'no', 'yes')
+        self.assertFalse(policy['preempt'])
+        self.assertEqual(plan_route_changes(view, BOTH_UP, PAIR_ENIS, policy), [])
+
+    def test_no_preempt_leaves_failed_over_routes(self):
+        view = route_table({DEFAULT_ROUTE: 'eni-1', SUMMARY_ROUTE: 'eni-1'})
+        policy = build_policy(SUMMARY_ROUTE, 'yes', 'no')
+        self.assertEqual(plan_route_changes(view, BOTH_UP, PAIR_ENIS, policy), [])
+
+    def test_preempt_does_not_move_routes_outside_the_policy(self):
+        view = route_table({DEFAULT_ROUTE: 'eni-1', SUMMARY_ROUTE: 'eni-2', '172.16.0.0/12': 'eni-1'})
+        policy = build_policy(SUMMARY_ROUTE, 'yes', 'yes')
+        self.assertEqual(plan_route_changes(view, BOTH_UP, PAIR_ENIS, policy), [])
+
+    def test_no_changes_when_nothing_is_healthy(self):
+        view = route_table({DEFAULT_ROUTE: 'eni-1', SUMMARY_ROUTE: 'eni-2'})
+        policy = build_policy(SUMMARY_ROUTE, 'yes', 'yes')
+        changes = plan_route_changes(view, {'fw1': 'down', 'fw2': 'down'}, PAIR_ENIS, policy)
+        self.assertEqual(changes, [])
+
+
+class PoolPlannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.prefixes = ['10.{}.0.0/16'.format(i) for i in range(30)]
+        self.policy = build_pool_policy(self.prefixes, 'yes')
+        self.all_up = {name: 'running' for name in POOL_ENIS}
+
+    def placed_routes(self, firewalls):
+        """
+        :return: Dictionary of every pool prefix to the eni of the firewall it hashes to
+        """
+        return {cidr: POOL_ENIS[hash_firewall(cidr, firewalls)] for cidr in self.prefixes}
+
+    def test_missing_prefixes_are_created(self):
+        view = route_table({'10.0.0.0/16': 'tgw-0123'})
+        changes = plan_route_changes(view, self.all_up, POOL_ENIS, self.policy)
+        # The prefix routed to the transit gateway is left alone
+        expected = [RouteChange(cidr, None, eni) for cidr, eni in sorted(self.placed_routes(sorted(POOL_ENIS)).items())
+                    if cidr != '10.0.0.0/16']
+        self.assertEqual(changes, expected)
+
+    def test_placed_pool_needs_no_changes(self):
+        view = route_table(self.placed_routes(sorted(POOL_ENIS)))
+        self.assertEqual(plan_route_changes(view, self.all_up, POOL_ENIS, self.policy), [])
+
+    def test_losing_a_firewall_only_remaps_its_prefixes(self):
+        routes = self.placed_routes(sorted(POOL_ENIS))
+        status = dict(self.all_up, fw2='down')
+        changes = plan_route_changes(route_table(routes), status, POOL_ENIS, self.policy)
+
+        moved = sorted(cidr for cidr, eni in routes.items() if eni == 'eni-2')
+        self.assertTrue(moved)
+        self.assertEqual([change.cidr for change in changes], moved)
+        for change in changes:
+            self.assertEqual(change.current_eni, 'eni-2')
+            self.assertEqual(change.desired_eni, POOL_ENIS[hash_firewall(change.cidr, ['fw1', 'fw3'])])
+
+    def test_pool_without_preempt_keeps_routes_on_healthy_firewalls(self):
+        routes = {cidr: 'eni-1' for cidr in self.prefixes}
+        policy = build_pool_policy(self.prefixes, 'no')
+        self.assertEqual(plan_route_changes(route_table(routes), self.all_up, POOL_ENIS, policy), [])
+
+
+if __name__ == '__main__':
+    unittest.main()